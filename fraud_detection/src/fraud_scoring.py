@@ -0,0 +1,91 @@
+import json
+import math
+import re
+
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+URL_PATTERN = re.compile(r"https?://|www\.", re.IGNORECASE)
+# Comments that talk to the model instead of about the order, e.g. "ignore previous instructions"
+INSTRUCTION_PATTERN = re.compile(
+    r"""\b(?:ignore|disregard|forget|override)\b.{0,40}\b(?:instructions?|rules?|prompts?|previous|above)\b
+    |\b(?:system|assistant|developer|admin)\s*:
+    |is_fraud
+    |\byou\s+(?:must|should|are\s+now)\b
+    |\b(?:return|output|respond|reply)\b.{0,40}\b(?:json|true|false)\b
+    |\b(?:mark|treat|flag|classify)\b.{0,40}\b(?:fraud\w*|legit\w*|safe|clean|approved?)\b
+    |\bverified\s+by\b
+    |[{}]""",
+    re.IGNORECASE | re.VERBOSE,
+)
+EXPRESS_SHIPPING = {"express", "next day", "overnight"}
+VOWELS = set("aeiouy")
+
+
+def _ratio(part, total):
+    return part / total if total else 0.0
+
+
+def _log_scaled(value, scale):
+    return min(math.log1p(max(value, 0)) / math.log1p(scale), 1.0)
+
+
+def is_instruction_like(comment):
+    return bool(INSTRUCTION_PATTERN.search(comment or ""))
+
+
+def extract_features(order):
+    """Features in 0..1 of an order in the `request_to_json` format."""
+    comment = order.get("user_comment") or ""
+    name = order["user"]["name"] or ""
+    letters = [c for c in name.lower() if c.isalpha()]
+    quantities = [item["quantity"] for item in order["items"]]
+    address = order["billing_address"]
+    payment = order["payment_features"]
+
+    return {
+        "contact_not_email": float(not EMAIL_PATTERN.match(order["user"]["contact"] or "")),
+        "name_has_digits": float(any(c.isdigit() for c in name)),
+        # Keyboard mashing, e.g. "xkcdqwrt"
+        "name_few_vowels": float(len(letters) >= 4 and _ratio(sum(c in VOWELS for c in letters), len(letters)) < 0.2),
+        "comment_non_alpha_ratio": _ratio(sum(not (c.isalpha() or c.isspace()) for c in comment), len(comment)),
+        "comment_has_url": float(bool(URL_PATTERN.search(comment))),
+        "comment_instruction_like": float(is_instruction_like(comment)),
+        "address_missing_fields": _ratio(sum(not (value or "").strip() for value in address.values()), len(address)),
+        "total_quantity": _log_scaled(sum(quantities), 100),
+        "max_quantity_over_10": float(any(quantity > 10 for quantity in quantities)),
+        "distinct_items": min(len(quantities) / 10, 1.0),
+        "express_shipping": float((order.get("shipping_method") or "").strip().lower() in EXPRESS_SHIPPING),
+        "gift_wrapping": float(bool(order.get("gift_wrapping"))),
+        "terms_not_accepted": float(not order.get("terms_accepted")),
+        "card_length_unusual": float(payment["cc_number_length"] != 16),
+        "cvv_length_unusual": float(payment["cvv_length"] != 3),
+    }
+
+
+class FraudModel:
+    """
+    Logistic regression over `extract_features`, stored as {"bias": float, "weights":
+    {feature: float}, "thresholds": {"accept": float, "reject": float}} by
+    train_fraud_model.py. Features without a weight are ignored. Scores below the accept
+    threshold are approved and scores at or above the reject threshold denied without
+    the AI; a model without thresholds sends every order to the AI.
+    """
+
+    def __init__(self, bias, weights, accept_score=0.0, reject_score=1.0):
+        self.bias = bias
+        self.weights = weights
+        self.accept_score = accept_score
+        self.reject_score = reject_score
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        weights = {str(name): float(weight) for name, weight in data["weights"].items()}
+        thresholds = data.get("thresholds", {})
+        return cls(float(data["bias"]), weights, float(thresholds.get("accept", 0.0)), float(thresholds.get("reject", 1.0)))
+
+    def score(self, features):
+        """Fraud probability of the order."""
+        z = self.bias + sum(weight * features.get(name, 0.0) for name, weight in self.weights.items())
+        return 1.0 / (1.0 + math.exp(-z))
@@ -0,0 +1,129 @@
+import csv
+import hashlib
+import math
+import re
+from array import array
+
+import numpy as np
+
+
+KINDS = ("user", "contact", "address", "card")
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+_HEX_FINGERPRINT = re.compile(r"^[0-9a-f]{64}$")
+_STREET_ABBREVIATIONS = {
+    "street": "st",
+    "avenue": "ave",
+    "road": "rd",
+    "boulevard": "blvd",
+    "drive": "dr",
+    "lane": "ln",
+    "apartment": "apt",
+}
+_MASK_64 = (1 << 64) - 1
+
+
+def card_fingerprint(number):
+    """SHA-256 of the card digits, the data file never holds card numbers in clear."""
+    return hashlib.sha256("".join(c for c in number if c.isdigit()).encode("ascii")).hexdigest()
+
+
+def normalize_address(value):
+    words = _SPACES.sub(" ", _NON_WORD.sub(" ", (value or "").lower())).split()
+    return " ".join(_STREET_ABBREVIATIONS.get(word, word) for word in words)
+
+
+def normalize(kind, value):
+    value = (value or "").strip()
+    if kind == "user":
+        return _SPACES.sub(" ", value.casefold())
+    if kind == "contact":
+        # Emails are case-insensitive, phone numbers are compared by their digits
+        return value.lower() if "@" in value else "".join(c for c in value if c.isdigit())
+    if kind == "address":
+        return normalize_address(value)
+    if kind == "card":
+        value = value.lower()
+        return value if _HEX_FINGERPRINT.match(value) else card_fingerprint(value)
+    raise ValueError(f"Unknown known fraud entry kind: {kind}")
+
+
+def _hashes(kind, value):
+    """Two 64-bit hashes of a normalized entry, the first one is also its exact fingerprint."""
+    digest = hashlib.blake2b(f"{kind}\0{value}".encode("utf-8"), digest_size=16).digest()
+    # An odd second hash visits distinct bits for every probe of the double hashing
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class KnownFraudIndex:
+    """
+    Known fraudulent users, contacts, addresses and cards.
+
+    Entries are kept as 64-bit fingerprints in a sorted array (8 bytes each whatever the
+    value length) behind a Bloom filter, so most lookups of clean values stop at a few
+    bit tests. Data files are CSV with a `kind,value` header, kind is one of KINDS;
+    card values are numbers or `card_fingerprint` hex digests.
+    """
+
+    def __init__(self, first_hashes, second_hashes, fp_rate=0.01, counts=None):
+        first_hashes = np.asarray(first_hashes, dtype=np.uint64)
+        second_hashes = np.asarray(second_hashes, dtype=np.uint64)
+        self.counts = counts or dict()
+        self._fingerprints = np.unique(first_hashes)
+
+        n = max(len(self._fingerprints), 1)
+        self._n_bits = max(64, math.ceil(-n * math.log(fp_rate) / math.log(2) ** 2 / 8) * 8)
+        self._n_probes = max(1, round(self._n_bits / n * math.log(2)))
+        bits = np.zeros(self._n_bits // 8, dtype=np.uint8)
+        for probe in range(self._n_probes):
+            # uint64 arithmetic wraps like the masked Python ints of _might_contain
+            positions = (first_hashes + np.uint64(probe) * second_hashes) % np.uint64(self._n_bits)
+            np.bitwise_or.at(bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self._bits = bits.tobytes()
+
+    @classmethod
+    def from_entries(cls, entries, fp_rate=0.01):
+        """`entries` is an iterable of (kind, value) pairs."""
+        first_hashes, second_hashes = array("Q"), array("Q")
+        counts = dict.fromkeys(KINDS, 0)
+        for kind, value in entries:
+            kind = kind.strip().lower()
+            value = normalize(kind, value)
+            if not value:
+                continue
+            first, second = _hashes(kind, value)
+            first_hashes.append(first)
+            second_hashes.append(second)
+            counts[kind] += 1
+        return cls(first_hashes, second_hashes, fp_rate=fp_rate, counts=counts)
+
+    @classmethod
+    def load(cls, path, fp_rate=0.01):
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls.from_entries(((row["kind"], row["value"]) for row in csv.DictReader(f)), fp_rate=fp_rate)
+
+    def _might_contain(self, first, second):
+        bits = self._bits
+        for probe in range(self._n_probes):
+            position = ((first + probe * second) & _MASK_64) % self._n_bits
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def contains(self, kind, value):
+        value = normalize(kind, value)
+        if not value:
+            return False
+        first, second = _hashes(kind, value)
+        if not self._might_contain(first, second):
+            return False
+        position = int(np.searchsorted(self._fingerprints, np.uint64(first)))
+        return position < len(self._fingerprints) and int(self._fingerprints[position]) == first
+
+    @property
+    def nbytes(self):
+        return self._fingerprints.nbytes + len(self._bits)
+
+    def __len__(self):
+        return len(self._fingerprints)
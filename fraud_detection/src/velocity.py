@@ -0,0 +1,112 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Window:
+    __slots__ = ("epoch", "total", "counts")
+
+    def __init__(self, epoch, n_buckets):
+        self.epoch = epoch
+        self.total = 0
+        self.counts = [0] * n_buckets
+
+
+class _Shard:
+    __slots__ = ("lock", "windows")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Least recently hit key first
+        self.windows = OrderedDict()
+
+
+class SlidingWindowCounter:
+    """
+    Number of hits per key over the last `window_sec`, counted in `n_buckets` buckets.
+
+    Every key keeps a ring of bucket counts and their running total, so a hit and its
+    count cost O(1) amortized: buckets that slid out of the window are subtracted as the
+    ring advances. The count is exact to one bucket width. At most `max_keys` keys are
+    tracked, the least recently hit ones are dropped first.
+    """
+
+    def __init__(self, window_sec, n_buckets=12, max_keys=100000, n_shards=16):
+        if window_sec <= 0 or n_buckets <= 0:
+            raise ValueError("window_sec and n_buckets must be positive")
+        self.window_sec = window_sec
+        self.n_buckets = n_buckets
+        self.bucket_sec = window_sec / n_buckets
+        self.n_shards = n_shards
+        self._shard_capacity = math.ceil(max_keys / n_shards)
+        self._shards = [_Shard() for _ in range(n_shards)]
+
+    def _advance(self, window, epoch):
+        """Slides the window to `epoch`, the bucket of `epoch` is empty afterwards if it moved."""
+        if epoch <= window.epoch:
+            return
+        if epoch - window.epoch >= self.n_buckets:
+            window.counts = [0] * self.n_buckets
+            window.total = 0
+        else:
+            for expired in range(window.epoch + 1, epoch + 1):
+                bucket = expired % self.n_buckets
+                window.total -= window.counts[bucket]
+                window.counts[bucket] = 0
+        window.epoch = epoch
+
+    def hit(self, key, now=None):
+        """Counts one hit of `key`, returns the number of hits in the window including this one."""
+        epoch = int((time.monotonic() if now is None else now) / self.bucket_sec)
+        shard = self._shards[hash(key) % self.n_shards]
+        with shard.lock:
+            window = shard.windows.get(key)
+            if window is None:
+                window = shard.windows[key] = _Window(epoch, self.n_buckets)
+                if len(shard.windows) > self._shard_capacity:
+                    shard.windows.popitem(last=False)
+            else:
+                shard.windows.move_to_end(key)
+                self._advance(window, epoch)
+            window.counts[epoch % self.n_buckets] += 1
+            window.total += 1
+            return window.total
+
+    def count(self, key, now=None):
+        epoch = int((time.monotonic() if now is None else now) / self.bucket_sec)
+        shard = self._shards[hash(key) % self.n_shards]
+        with shard.lock:
+            window = shard.windows.get(key)
+            if window is None:
+                return 0
+            self._advance(window, epoch)
+            return window.total
+
+    def __len__(self):
+        return sum(len(shard.windows) for shard in self._shards)
+
+
+class VelocityLimit:
+    """At most `max_orders` orders per `window_sec` with the same `dimension` value."""
+
+    def __init__(self, dimension, window_sec, max_orders, n_buckets=12, max_keys=100000):
+        self.dimension = dimension
+        self.window_sec = window_sec
+        self.max_orders = max_orders
+        self.counter = SlidingWindowCounter(window_sec, n_buckets=n_buckets, max_keys=max_keys)
+
+    @classmethod
+    def parse(cls, spec, n_buckets=12, max_keys=100000):
+        """Limits from `dimension:window_sec:max_orders` entries separated by commas."""
+        limits = []
+        for entry in spec.split(","):
+            if not entry.strip():
+                continue
+            dimension, window_sec, max_orders = (part.strip() for part in entry.split(":"))
+            limits.append(cls(dimension, float(window_sec), int(max_orders), n_buckets=n_buckets, max_keys=max_keys))
+        return limits
+
+    def hit(self, value, now=None):
+        """Counts an order with this value, returns its count in the window."""
+        return self.counter.hit(value, now=now)
@@ -8,6 +8,12 @@ from flask import Flask, request
 from flask_cors import CORS
 from flask.logging import default_handler
 from waitress import serve
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+import uvicorn
 
 import json
 import asyncio
@@ -15,6 +21,8 @@ import sys
 import os
 import uuid
 import time
+import math
+import collections
 from contextlib import contextmanager, asynccontextmanager
 
 import grpc
@@ -43,6 +51,9 @@ import pb.services.order_queue_pb2_grpc as order_queue_grpc
 import pb.services.order_details_pb2 as order_details
 
 
+from grpc_utils.channel_pool import AioChannelRegistry
+from grpc_utils.deadline import deadline_call_options
+
 from telemetry.telemetry import get_telemetry
 from opentelemetry.metrics import Observation
 tracer, meter = get_telemetry("orchestrator")
@@ -90,13 +101,37 @@ meter.create_observable_gauge(
     description="Current process CPU utilization as a fraction of total CPU capacity",
 )
 
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, retry_after, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.message = message
+
+
 class ActiveRequestLoad:
+    """
+    Tracks in-flight checkouts and admits new ones against an adaptive concurrency limit.
+
+    Requests over the limit wait in a bounded FIFO queue. A full queue is rejected with 429,
+    a request that waits longer than queue_timeout is rejected with 503. The limit follows
+    AIMD on checkout latency: it grows by 1/limit per request finished under target_latency
+    and shrinks by decrease_factor (at most once per target_latency) otherwise.
+    The async admission API must be used from a single event loop.
+    """
+
     def __init__(
         self,
         capacity = 1,
         mode = "capacity",
         clamp = True,
         attributes = None,
+        max_queue_depth = 0,
+        queue_timeout = 0.0,
+        adaptive = False,
+        min_capacity = 1,
+        target_latency = 10.0,
+        decrease_factor = 0.9,
     ):
         if capacity <= 0:
             raise ValueError("capacity must be positive")
@@ -104,13 +139,30 @@ class ActiveRequestLoad:
         if mode not in {"capacity", "busy"}:
             raise ValueError("mode must be either 'capacity' or 'busy'")
 
+        if not 0 < min_capacity <= capacity:
+            raise ValueError("min_capacity must be positive and not larger than capacity")
+
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1")
+
+        self.max_capacity = capacity
         self.capacity = capacity
         self.mode = mode
         self.clamp = clamp
         self.attributes = dict(attributes or {})
 
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_capacity = min_capacity
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+
         self._lock = threading.Lock()
         self._active_requests = 0
+        self._waiters = collections.deque()
+        self._mean_latency = target_latency
+        self._last_decrease = 0.0
 
         now = time.monotonic()
         self._last_update = now
@@ -138,6 +190,36 @@ class ActiveRequestLoad:
         self._load_area += current_load * dt
         self._last_update = now
 
+    def _has_free_slot_locked(self):
+        return self._active_requests < int(self.capacity)
+
+    def _retry_after_locked(self):
+        # Rough time for the current queue to drain at the current limit.
+        drain_time = self._mean_latency * (len(self._waiters) + 1) / max(int(self.capacity), 1)
+        return max(1, math.ceil(drain_time))
+
+    def _adjust_capacity_locked(self, latency, now):
+        self._mean_latency = 0.8 * self._mean_latency + 0.2 * latency
+
+        if not self.adaptive:
+            return
+
+        if latency <= self.target_latency:
+            self.capacity = min(self.max_capacity, self.capacity + 1 / self.capacity)
+        elif now - self._last_decrease >= self.target_latency:
+            self.capacity = max(self.min_capacity, self.capacity * self.decrease_factor)
+            self._last_decrease = now
+
+    def _wake_waiters_locked(self, now):
+        while self._waiters and self._has_free_slot_locked():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            # The slot is handed over to the waiter.
+            self._advance_locked(now)
+            self._active_requests += 1
+            waiter.set_result(None)
+
     def start_request(self):
         now = time.monotonic()
 
@@ -145,7 +227,7 @@ class ActiveRequestLoad:
             self._advance_locked(now)
             self._active_requests += 1
 
-    def finish_request(self):
+    def finish_request(self, latency=None):
         now = time.monotonic()
 
         with self._lock:
@@ -156,6 +238,45 @@ class ActiveRequestLoad:
 
             self._active_requests -= 1
 
+            if latency is not None:
+                self._adjust_capacity_locked(latency, now)
+            self._wake_waiters_locked(now)
+
+    async def acquire(self):
+        with self._lock:
+            if not self._waiters and self._has_free_slot_locked():
+                self._advance_locked(time.monotonic())
+                self._active_requests += 1
+                return
+
+            if len(self._waiters) >= self.max_queue_depth:
+                raise AdmissionRejected(429, self._retry_after_locked(), "Too many checkouts in progress, retry later")
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+            return
+        except BaseException as e:
+            with self._lock:
+                granted = waiter.done() and not waiter.cancelled()
+                if not granted:
+                    waiter.cancel()
+                    self._waiters.remove(waiter)
+                    retry_after = self._retry_after_locked()
+
+            if granted:
+                if isinstance(e, asyncio.TimeoutError):
+                    # The slot arrived together with the timeout.
+                    return
+                self.finish_request()
+                raise
+
+            if isinstance(e, asyncio.TimeoutError):
+                raise AdmissionRejected(503, retry_after, "Checkout capacity is saturated, retry later") from None
+            raise
+
     @contextmanager
     def track_request(self):
         self.start_request()
@@ -166,7 +287,12 @@ class ActiveRequestLoad:
 
     @asynccontextmanager
     async def track_request_async(self):
-        return self.track_request()
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.finish_request(latency=time.monotonic() - started)
 
     def observe_load(self, options):
         now = time.monotonic()
@@ -187,10 +313,94 @@ class ActiveRequestLoad:
         print(f"ActiveRequestLoad.observe_load: active_requests={self._active_requests}, load={value:.2f}")
         yield Observation(value)
 
+    def observe_queue_depth(self, options):
+        with self._lock:
+            depth = len(self._waiters)
+        yield Observation(depth)
+
+    def observe_capacity(self, options):
+        with self._lock:
+            capacity = int(self.capacity)
+        yield Observation(capacity)
+
 MAX_TREADS = 16
 
+# "waitress" serves the Flask app from a thread pool, "asgi" serves the same endpoints
+# from a single event loop with uvicorn.
+ORCHESTRATOR_SERVER = os.environ.get("ORCHESTRATOR_SERVER", "waitress")
+ASGI_CONCURRENCY_LIMIT = int(os.environ.get("ASGI_CONCURRENCY_LIMIT", "512"))
+
+if ORCHESTRATOR_SERVER not in {"waitress", "asgi"}:
+    raise ValueError("ORCHESTRATOR_SERVER must be either 'waitress' or 'asgi'")
+
+TRANSACTION_VERIFICATION_TARGET = os.environ.get("TRANSACTION_VERIFICATION_GRPC_TARGET", "transaction_verification:50052")
+FRAUD_DETECTION_TARGET = os.environ.get("FRAUD_DETECTION_GRPC_TARGET", "fraud_detection:50051")
+RECOMMENDATION_SYSTEM_TARGET = os.environ.get("RECOMMENDATION_GRPC_TARGET", "recommendation_system:50053")
+ORDER_QUEUE_TARGET = os.environ.get("ORDER_QUEUE_GRPC_TARGET", "order_queue:50054")
+
+# "fused" sends the order once with InitAndVerify, "three_phase" keeps the old
+# InitTransaction broadcast followed by VerifyItems.
+CHECKOUT_FLOW = os.environ.get("CHECKOUT_FLOW", "fused")
+
+if CHECKOUT_FLOW not in {"fused", "three_phase"}:
+    raise ValueError("CHECKOUT_FLOW must be either 'fused' or 'three_phase'")
+
+CLEAR_BATCH_INTERVAL_MS = int(os.environ.get("CLEAR_BATCH_INTERVAL_MS", "50"))
+CLEAR_BATCH_MAX_SIZE = int(os.environ.get("CLEAR_BATCH_MAX_SIZE", "256"))
+
+# Budget for the whole validation chain, forwarded to every service through gRPC metadata.
+CHECKOUT_DEADLINE_MS = int(os.environ.get("CHECKOUT_DEADLINE_MS", "20000"))
+# Timeout for calls outside of the validation chain (Enqueue, ClearTransactions).
+GRPC_CALL_TIMEOUT_MS = int(os.environ.get("GRPC_CALL_TIMEOUT_MS", "5000"))
+
+ADMISSION_MAX_QUEUE_DEPTH = int(os.environ.get("ADMISSION_MAX_QUEUE_DEPTH", "64"))
+ADMISSION_QUEUE_TIMEOUT_MS = int(os.environ.get("ADMISSION_QUEUE_TIMEOUT_MS", "5000"))
+ADMISSION_ADAPTIVE = os.environ.get("ADMISSION_ADAPTIVE", "true").lower() == "true"
+ADMISSION_MIN_CONCURRENCY = int(os.environ.get("ADMISSION_MIN_CONCURRENCY", "2"))
+ADMISSION_TARGET_LATENCY_MS = int(os.environ.get("ADMISSION_TARGET_LATENCY_MS", "10000"))
+# Waitress needs a thread for every admitted and queued checkout, plus spare threads that
+# answer 429 when the queue is full; with fewer threads the excess waits unbounded in its backlog.
+WAITRESS_REJECT_THREADS = int(os.environ.get("WAITRESS_REJECT_THREADS", "4"))
+WAITRESS_THREADS = MAX_TREADS + ADMISSION_MAX_QUEUE_DEPTH + WAITRESS_REJECT_THREADS
+
+
+class BackgroundEventLoop:
+    """
+    Long-lived asyncio loop running in a daemon thread.
+
+    WSGI worker threads submit checkout coroutines here instead of creating a fresh loop
+    per request, which would make every request open its own gRPC connections.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name=self.name, daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coro):
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+channel_registry = AioChannelRegistry()
+checkout_loop = BackgroundEventLoop("checkout-event-loop")
+
 request_load = ActiveRequestLoad(
-    capacity=MAX_TREADS
+    capacity=ASGI_CONCURRENCY_LIMIT if ORCHESTRATOR_SERVER == "asgi" else MAX_TREADS,
+    max_queue_depth=ADMISSION_MAX_QUEUE_DEPTH,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT_MS / 1000,
+    adaptive=ADMISSION_ADAPTIVE,
+    min_capacity=ADMISSION_MIN_CONCURRENCY,
+    target_latency=ADMISSION_TARGET_LATENCY_MS / 1000,
 )
 
 meter.create_observable_gauge(
@@ -199,6 +409,17 @@ meter.create_observable_gauge(
     unit="1",
     description="Time-weighted active request load as a fraction of capacity",
 )
+meter.create_observable_gauge(
+    name="CheckoutAdmissionQueueDepth",
+    callbacks=[request_load.observe_queue_depth],
+    description="Checkouts waiting for admission",
+)
+meter.create_observable_gauge(
+    name="CheckoutConcurrencyLimit",
+    callbacks=[request_load.observe_capacity],
+    description="Current adaptive limit of concurrent checkouts",
+)
+rejected_checkout_counter = meter.create_counter(name="RejectedCheckouts")
 
 
 
@@ -241,42 +462,29 @@ def create_input_order_details(request_data, order_id):
     )
 
 async def add_to_order_queue(order_details):
-    async with grpc.aio.insecure_channel('order_queue:50054') as channel:
-        stub = order_queue_grpc.OrderQueueServiceStub(channel)
-        response = await stub.Enqueue(order_details)
+    response = await channel_registry.call(ORDER_QUEUE_TARGET, order_queue_grpc.OrderQueueServiceStub, "Enqueue", order_details, timeout=GRPC_CALL_TIMEOUT_MS / 1000)
     logger.info(f"Added order with ID: {order_details.order_id} to the queue")
     return response
 
-async def init_transaction(request_data, order_id, connection_string, stub_class):
-    async with grpc.aio.insecure_channel(connection_string) as channel:
-        stub = stub_class(channel)
-        input_order_details = create_input_order_details(request_data, order_id)
-        response = await stub.InitTransaction(input_order_details)
+async def init_transaction(request_data, order_id, connection_string, stub_class, deadline):
+    input_order_details = create_input_order_details(request_data, order_id)
+    response = await channel_registry.call(connection_string, stub_class, "InitTransaction", input_order_details, **deadline_call_options(deadline))
     logger.info(f"InitTransaction - Order ID: {order_id}, Service: {connection_string}, Done")
     return response
 
-async def clear_transaction(order_id, vector_clock, connection_string, stub_class):
-    async with grpc.aio.insecure_channel(connection_string) as channel:
-        stub = stub_class(channel)
-        request = order_details.OperationalMessage(
-            order_id=order_id,
-            vector_clock=vector_clock
-        )
-        response = await stub.ClearTransaction(request)
-    logger.info(f"ClearTransaction - Order ID: {order_id}, Service: {connection_string}, Done")
+async def init_and_verify(request_data, order_id, deadline):
+    input_order_details = create_input_order_details(request_data, order_id)
+    response = await channel_registry.call(TRANSACTION_VERIFICATION_TARGET, transaction_verification_grpc.TransactionVerificationServiceStub, "InitAndVerify", input_order_details, **deadline_call_options(deadline))
+    logger.info(f"InitAndVerify - Order ID: {order_id}, Done")
     return response
 
-async def call_action(order_id, connection_string, stub_class, method_name, vector_clock=[0,0,0]):
-    async with grpc.aio.insecure_channel(connection_string) as channel:
-        stub = stub_class(channel)
-        fraud_request = order_details.OperationalMessage(
-            order_id=order_id,
-            vector_clock=vector_clock,
-        )
-        method = getattr(stub, method_name)
-        response = await method(fraud_request)
-
-    return response
+async def call_action(order_id, connection_string, stub_class, method_name, vector_clock=[0,0,0], deadline=None):
+    fraud_request = order_details.OperationalMessage(
+        order_id=order_id,
+        vector_clock=vector_clock,
+    )
+    call_options = deadline_call_options(deadline) if deadline is not None else {}
+    return await channel_registry.call(connection_string, stub_class, method_name, fraud_request, **call_options)
 
 def merge_into_general_vector_clock(general_vector_clock, *results):
     for result in results:
@@ -293,26 +501,85 @@ async def call_parallel_services(general_vector_clock, *services):
     general_vector_clock = merge_into_general_vector_clock(general_vector_clock, *results)
     return general_vector_clock, "", results
 
-async def clear_parallel_services(order_id, vector_clock):
-    return await asyncio.gather(
-        clear_transaction(order_id, vector_clock, "transaction_verification:50052", transaction_verification_grpc.TransactionVerificationServiceStub),
-        clear_transaction(order_id, vector_clock, "fraud_detection:50051", fraud_detection_grpc.FraudDetectionServiceStub),
-        clear_transaction(order_id, vector_clock, "recommendation_system:50053", recommendation_system_grpc.RecommendationServiceStub),
-    )
-
-@app.route('/checkout', methods=['POST'])
-async def checkout():
+class ClearTransactionBatcher:
     """
-    Responds with a JSON object containing the order ID, status, and suggested books.
+    Clears finished orders off the response path.
+
+    Orders submitted within one interval are sent to every validation service
+    as a single ClearTransactions call. Must be used from one event loop.
     """
-    with request_load.track_request():
+
+    def __init__(self, services, interval_ms, max_batch_size):
+        if max_batch_size <= 0:
+            raise ValueError("max_batch_size must be positive")
+
+        self.services = services
+        self.interval = interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._flusher = None
+        self._in_flight = set()
+
+    def submit(self, order_id, vector_clock):
+        self._pending.append(order_details.OperationalMessage(
+            order_id=order_id,
+            vector_clock=vector_clock
+        ))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < self.max_batch_size:
+                await asyncio.sleep(self.interval)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+
+            task = asyncio.get_running_loop().create_task(self._flush(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _flush(self, batch):
+        request = order_details.OperationalMessageBatch(messages=batch)
+        results = await asyncio.gather(*(
+            channel_registry.call(target, stub_class, "ClearTransactions", request, timeout=GRPC_CALL_TIMEOUT_MS / 1000)
+            for target, stub_class in self.services
+        ), return_exceptions=True)
+
+        for (target, _), result in zip(self.services, results):
+            if isinstance(result, Exception):
+                logger.error(f"ClearTransactions - Service: {target}, {len(batch)} orders, Failed: {str(result)}")
+                continue
+            failed = [status.order_id for status in result.statuses if not status.success]
+            if failed:
+                logger.warning(f"ClearTransactions - Service: {target}, not cleared: {failed}")
+            logger.info(f"ClearTransactions - Service: {target}, {len(batch)} orders, Done")
+
+    async def drain(self):
+        while self._flusher is not None and not self._flusher.done():
+            await self._flusher
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+
+clear_batcher = ClearTransactionBatcher(
+    services=[
+        (TRANSACTION_VERIFICATION_TARGET, transaction_verification_grpc.TransactionVerificationServiceStub),
+        (FRAUD_DETECTION_TARGET, fraud_detection_grpc.FraudDetectionServiceStub),
+        (RECOMMENDATION_SYSTEM_TARGET, recommendation_system_grpc.RecommendationServiceStub),
+    ],
+    interval_ms=CLEAR_BATCH_INTERVAL_MS,
+    max_batch_size=CLEAR_BATCH_MAX_SIZE,
+)
+
+async def process_checkout(request_data):
+    async with request_load.track_request_async():
         start_time = time.time()
         with tracer.start_as_current_span("process_checkout_request") as span:
             order_id = str(uuid.uuid4())
             span.set_attribute("order_id", order_id)
 
             with tracer.start_as_current_span("parse_request_data"):
-                request_data = json.loads(request.data)
                 logger.info(f"Request Data: {request_data.get('items')}")
 
                 general_vector_clock = [0, 0, 0]
@@ -322,22 +589,40 @@ async def checkout():
                     'suggestedBooks': suggested_books
                 }
 
-            with tracer.start_as_current_span("init_order_validation"):
-                _ = await asyncio.gather(
-                    init_transaction(request_data, order_id, "transaction_verification:50052", transaction_verification_grpc.TransactionVerificationServiceStub),
-                    init_transaction(request_data, order_id, "fraud_detection:50051", fraud_detection_grpc.FraudDetectionServiceStub),
-                    init_transaction(request_data, order_id, "recommendation_system:50053", recommendation_system_grpc.RecommendationServiceStub),
-                )
-
-            with tracer.start_as_current_span("validate_order"):
-                general_vector_clock, error_message, results = await call_parallel_services(
-                    general_vector_clock,
-                    call_action(order_id, "transaction_verification:50052", transaction_verification_grpc.TransactionVerificationServiceStub, "VerifyItems", vector_clock=general_vector_clock),
-                )
-            
+            deadline = start_time + CHECKOUT_DEADLINE_MS / 1000
+
+            try:
+                if CHECKOUT_FLOW == "fused":
+                    with tracer.start_as_current_span("init_and_validate_order"):
+                        general_vector_clock, error_message, results = await call_parallel_services(
+                            general_vector_clock,
+                            init_and_verify(request_data, order_id, deadline),
+                        )
+                else:
+                    with tracer.start_as_current_span("init_order_validation"):
+                        _ = await asyncio.gather(
+                            init_transaction(request_data, order_id, TRANSACTION_VERIFICATION_TARGET, transaction_verification_grpc.TransactionVerificationServiceStub, deadline),
+                            init_transaction(request_data, order_id, FRAUD_DETECTION_TARGET, fraud_detection_grpc.FraudDetectionServiceStub, deadline),
+                            init_transaction(request_data, order_id, RECOMMENDATION_SYSTEM_TARGET, recommendation_system_grpc.RecommendationServiceStub, deadline),
+                        )
+
+                    with tracer.start_as_current_span("validate_order"):
+                        general_vector_clock, error_message, results = await call_parallel_services(
+                            general_vector_clock,
+                            call_action(order_id, TRANSACTION_VERIFICATION_TARGET, transaction_verification_grpc.TransactionVerificationServiceStub, "VerifyItems", vector_clock=general_vector_clock, deadline=deadline),
+                        )
+            except grpc.aio.AioRpcError as e:
+                # A timed out or unavailable service counts as a failed validation event
+                logger.error(f"Order validation RPC failed - Order ID: {order_id}, Code: {e.code().name}, Details: {e.details()}")
+                if e.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+                    error_message = "Order validation did not finish in time"
+                else:
+                    error_message = f"Order validation failed: {e.details()}"
+
+
             if error_message:
                 with tracer.start_as_current_span("return_failed_order_validation"):
-                    _ = await clear_parallel_services(order_id, general_vector_clock)
+                    clear_batcher.submit(order_id, general_vector_clock)
                     order_response["status"] = "Order Denied"
                     order_response["errorMessage"] = error_message
                     return order_response
@@ -352,7 +637,7 @@ async def checkout():
                 } for book in recommended_books]
 
             with tracer.start_as_current_span("clear_order_validation"):
-                _ = await clear_parallel_services(order_id, general_vector_clock)
+                clear_batcher.submit(order_id, general_vector_clock)
 
             successfull_order_counter.add(1)
 
@@ -364,6 +649,69 @@ async def checkout():
 
             return order_response
 
+@app.route('/checkout', methods=['POST'])
+def checkout():
+    """
+    Responds with a JSON object containing the order ID, status, and suggested books.
+    """
+    request_data = json.loads(request.data)
+    # All checkouts share one event loop, so pooled aio channels are reused across requests.
+    try:
+        return checkout_loop.run(process_checkout(request_data))
+    except AdmissionRejected as e:
+        body, status_code, headers = admission_rejected_response(e)
+        return body, status_code, headers
+
+
+def admission_rejected_response(rejection):
+    logger.warning(f"Checkout rejected with {rejection.status_code}: {rejection.message}")
+    rejected_checkout_counter.add(1, {"status_code": rejection.status_code})
+    body = {
+        "error": {
+            "code": "TOO_MANY_REQUESTS" if rejection.status_code == 429 else "SERVICE_UNAVAILABLE",
+            "message": rejection.message,
+        }
+    }
+    return body, rejection.status_code, {"Retry-After": str(rejection.retry_after)}
+
+
+class FlaskCompatibleJSONResponse(JSONResponse):
+    """Renders JSON the way Flask does (sorted keys, trailing newline) to keep responses identical."""
+
+    def render(self, content):
+        return (json.dumps(content, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+async def asgi_index(request):
+    return PlainTextResponse("hello from orchestrator", media_type="text/html")
+
+
+async def asgi_checkout(request):
+    request_data = json.loads(await request.body())
+    # Runs directly on the server loop, so pooled aio channels are shared by every in-flight checkout.
+    try:
+        return FlaskCompatibleJSONResponse(await process_checkout(request_data))
+    except AdmissionRejected as e:
+        body, status_code, headers = admission_rejected_response(e)
+        return FlaskCompatibleJSONResponse(body, status_code=status_code, headers=headers)
+
+
+@asynccontextmanager
+async def asgi_lifespan(_app):
+    yield
+    await clear_batcher.drain()
+    await channel_registry.close()
+
+
+asgi_app = Starlette(
+    routes=[
+        Route('/', asgi_index, methods=['GET']),
+        Route('/checkout', asgi_checkout, methods=['POST']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=asgi_lifespan,
+)
+
 
 
 if __name__ == '__main__':
@@ -372,4 +720,9 @@ if __name__ == '__main__':
     # This is useful for development.
     # The default port is 5000.
     # app.run(host='0.0.0.0')
-    serve(app, host='0.0.0.0', port=5000, threads=MAX_TREADS)
+    if ORCHESTRATOR_SERVER == "asgi":
+        # grpc.aio needs the default asyncio loop, not uvloop.
+        # Concurrency is limited by request_load admission, which answers with 429/503 and Retry-After.
+        uvicorn.run(asgi_app, host='0.0.0.0', port=5000, loop="asyncio")
+    else:
+        serve(app, host='0.0.0.0', port=5000, threads=WAITRESS_THREADS)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import re
@@ -19,6 +20,13 @@ sys.path.insert(0, services_pb_path)
 sys.path.insert(0, pb_path)
 from log_utils.logger import setup_logger
 from service_wrappers.base_service_wrapper import BaseServiceWrapper
+from service_wrappers.order_state_store import OrderRecord
+from grpc_utils.deadline import remaining_budget
+from other.async_llm import AsyncLlmClient
+from other.keyword_matcher import KeywordMatcher
+from catalog_index import CatalogIndex
+from candidate_retrieval import CandidateIndex, compact_record
+from vector_engine import VectorRecommender
 
 import pb.services.order_details_pb2 as order_details
 import pb.services.recommendation_system_pb2 as recommendation_system
@@ -29,7 +37,28 @@ logger = setup_logger("RecommendationSystem")
 OPENAI_MODEL = (os.environ.get("OPENAI_MODEL") or "gpt-5.2").strip() or "gpt-5.2"
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 open_ai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# sync: one handler thread per request; aio: grpc.aio server with the AI calls as coroutines
+GRPC_SERVER_MODE = os.environ.get("GRPC_SERVER_MODE", "sync")
+# aio mode: AI calls in flight at once, the others wait without holding a thread or a connection
+AI_MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", "64"))
+async_llm_client = AsyncLlmClient(OPENAI_API_KEY, OPENAI_MODEL, max_concurrency=AI_MAX_CONCURRENCY) if OPENAI_API_KEY else None
 DEFAULT_TOP_K = 3
+# AI recommendations are skipped in favour of the catalog fallback when less budget than this is left.
+AI_RECOMMENDATION_MIN_BUDGET_MS = int(os.environ.get("AI_RECOMMENDATION_MIN_BUDGET_MS", "2000"))
+# ai: LLM picks from the candidates, local ranking only as fallback; vector: local TF-IDF similarity ranking only
+RECOMMENDATION_ENGINE = os.environ.get("RECOMMENDATION_ENGINE", "ai")
+if RECOMMENDATION_ENGINE not in {"ai", "vector"}:
+    raise ValueError("RECOMMENDATION_ENGINE must be either 'ai' or 'vector'")
+# Hashed feature space of the vector engine; vectors are stored sparse, so a large space costs
+# only the posting list offsets (8 bytes per feature) and keeps hash collisions rare
+RECOMMENDATION_VECTOR_DIM = int(os.environ.get("RECOMMENDATION_VECTOR_DIM", "262144"))
+# Opt-in bound on vector query cost: features of more books than this are treated as catalog stop
+# words and left out of the postings, which approximates the ranking. Unset or 0 ranks exactly.
+RECOMMENDATION_VECTOR_MAX_POSTINGS = int(os.environ.get("RECOMMENDATION_VECTOR_MAX_POSTINGS") or "0") or None
+# Books preselected locally and sent to the LLM, the prompt does not grow with the catalog
+RECOMMENDATION_CANDIDATES = int(os.environ.get("RECOMMENDATION_CANDIDATES", "20"))
+# Genre keywords of user comments, `label,keyword` CSV with the genre as label
+GENRE_KEYWORDS_PATH = os.environ.get("GENRE_KEYWORDS_PATH", os.path.join(base_dir, "genre_keywords.csv"))
 
 BOOK_CATALOG: list[dict[str, Any]] = [
     {
@@ -131,7 +160,8 @@ BOOK_CATALOG: list[dict[str, Any]] = [
         "description": "How people think, decide and make mistakes in judgment.",
     },
 ]
-BOOK_BY_ID = {book["bookId"]: book for book in BOOK_CATALOG}
+CATALOG_INDEX = CatalogIndex(BOOK_CATALOG)
+BOOK_BY_ID = CATALOG_INDEX.by_id
 GENRE_HINTS = {
     "fantasy": ["fantasy", "magic", "wizard", "dragon", "epic"],
     "science fiction": ["sci-fi", "science fiction", "space", "future", "alien"],
@@ -142,6 +172,24 @@ GENRE_HINTS = {
 }
 
 
+
+def load_genre_keywords() -> KeywordMatcher:
+    try:
+        matcher = KeywordMatcher.load(GENRE_KEYWORDS_PATH)
+        logger.info(f"Loaded {len(matcher)} genre keywords from {GENRE_KEYWORDS_PATH}")
+        return matcher
+    except (OSError, KeyError) as e:
+        logger.warning(f"Failed to load genre keywords, using GENRE_HINTS: {e}")
+        return KeywordMatcher.from_mapping(GENRE_HINTS)
+
+
+GENRE_KEYWORDS = load_genre_keywords()
+CANDIDATE_INDEX = CandidateIndex(CATALOG_INDEX)
+VECTOR_RECOMMENDER = VectorRecommender(
+    CATALOG_INDEX, n_features=RECOMMENDATION_VECTOR_DIM, max_postings=RECOMMENDATION_VECTOR_MAX_POSTINGS
+) if RECOMMENDATION_ENGINE == "vector" else None
+
+
 def format_recommendation_log(books: list[order_details.RecommendedBook]) -> str:
     if not books:
         return "[]"
@@ -161,13 +209,10 @@ def parse_ai_json_object(text: str) -> dict[str, Any]:
 
 
 def _fallback_recommendations(cart_titles: list[str], top_k: int) -> list[order_details.RecommendedBook]:
-    cart_title_set = {title.lower() for title in cart_titles if title}
-    candidates = [
-        book for book in BOOK_CATALOG if book["title"].lower() not in cart_title_set
-    ]
+    candidates = CATALOG_INDEX.first_books(cart_titles, top_k)
 
     suggestions: list[order_details.RecommendedBook] = []
-    for book in candidates[:top_k]:
+    for book in candidates:
         suggestions.append(
             order_details.RecommendedBook(
                 book_id=book["bookId"],
@@ -181,42 +226,19 @@ def _fallback_recommendations(cart_titles: list[str], top_k: int) -> list[order_
 
 
 def _extract_comment_genres(comment: str) -> list[str]:
-    lowered = (comment or "").lower()
-    if not lowered:
-        return []
-    genres = []
-    for genre, hints in GENRE_HINTS.items():
-        if any(hint in lowered for hint in hints):
-            genres.append(genre)
-    return genres
+    return GENRE_KEYWORDS.match(comment)
 
 
 def _extract_cart_genres(cart_titles: list[str]) -> list[str]:
-    title_set = {title.lower() for title in cart_titles if title}
-    genres = set()
-    for book in BOOK_CATALOG:
-        if book["title"].lower() in title_set:
-            for genre in book.get("genres", []):
-                genres.add(genre)
-    return sorted(genres)
+    return CATALOG_INDEX.genres_of_titles(cart_titles)
 
 
 def _genre_fallback_recommendations(
     cart_titles: list[str], preferred_genres: list[str], top_k: int
 ) -> list[order_details.RecommendedBook]:
-    cart_title_set = {title.lower() for title in cart_titles if title}
     preferred = set(preferred_genres)
-    scored: list[tuple[int, dict[str, Any]]] = []
-
-    for book in BOOK_CATALOG:
-        if book["title"].lower() in cart_title_set:
-            continue
-        overlap = len(preferred.intersection(book.get("genres", [])))
-        scored.append((overlap, book))
-
-    scored.sort(key=lambda item: (item[0], item[1]["bookId"]), reverse=True)
     out: list[order_details.RecommendedBook] = []
-    for overlap, book in scored[:top_k]:
+    for overlap, book in CATALOG_INDEX.top_by_genre_overlap(preferred, cart_titles, top_k):
         reason = (
             f"Matched your preferred genres: {', '.join(sorted(preferred.intersection(book.get('genres', []))))}."
             if overlap > 0
@@ -234,13 +256,16 @@ def _genre_fallback_recommendations(
     return out
 
 
-def request_ai_recommendations(
-    cart_titles: list[str], comment: str, top_k: int
-) -> list[order_details.RecommendedBook]:
-    if not open_ai_client:
-        raise RuntimeError("OPENAI_API_KEY is missing.")
+def recommendation_candidates(
+    cart_titles: list[str], comment: str, preferred_genres: list[str]
+) -> list[dict[str, Any]]:
+    return CANDIDATE_INDEX.top_candidates(cart_titles, comment, preferred_genres, RECOMMENDATION_CANDIDATES)
+
 
-    prompt = f"""You are a book recommendation engine.
+def recommendation_prompt(
+    cart_titles: list[str], comment: str, top_k: int, candidates: list[dict[str, Any]]
+) -> str:
+    return f"""You are a book recommendation engine.
 
 Task:
 - Choose exactly {top_k} books from CATALOG for this user.
@@ -263,22 +288,21 @@ INPUT:
 {{
   "cart_titles": {json.dumps(cart_titles)},
   "user_comment": {json.dumps(comment)},
-  "catalog": {json.dumps(BOOK_CATALOG)}
+  "catalog": {json.dumps([compact_record(book) for book in candidates])}
 }}
 """
 
-    response = open_ai_client.responses.create(
-        model=OPENAI_MODEL,
-        input=[{"role": "user", "content": prompt}],
-        temperature=0.2,
-        max_output_tokens=400,
-    )
-    parsed = parse_ai_json_object((response.output_text or "").strip())
+
+def parse_ai_recommendations(
+    text: str, cart_titles: list[str], top_k: int, candidates: list[dict[str, Any]]
+) -> list[order_details.RecommendedBook]:
+    parsed = parse_ai_json_object(text)
     raw_recommendations = parsed.get("recommendations", [])
     if not isinstance(raw_recommendations, list):
         raise ValueError("AI output field 'recommendations' is not a list.")
 
-    cart_title_set = {title.lower() for title in cart_titles if title}
+    cart_positions = CATALOG_INDEX.title_positions(cart_titles)
+    candidate_ids = {book["bookId"] for book in candidates}
     results: list[order_details.RecommendedBook] = []
     used_ids: set[str] = set()
 
@@ -290,11 +314,11 @@ INPUT:
         reason = str(entry.get("reason", "")).strip()
         short_description = str(entry.get("shortDescription", "")).strip()
         book = BOOK_BY_ID.get(book_id)
-        if not book:
+        if not book or book_id not in candidate_ids:
             continue
         if book_id in used_ids:
             continue
-        if book["title"].lower() in cart_title_set:
+        if CATALOG_INDEX.position_by_id[book_id] in cart_positions:
             continue
         if not reason:
             reason = "Selected by AI based on your cart and preferences."
@@ -319,14 +343,69 @@ INPUT:
     return results
 
 
+def vector_recommendations(
+    cart_titles: list[str], comment: str, preferred_genres: list[str], top_k: int
+) -> list[order_details.RecommendedBook]:
+    preferred = set(preferred_genres)
+    out: list[order_details.RecommendedBook] = []
+    for book, _ in VECTOR_RECOMMENDER.top_k(cart_titles, comment, preferred, top_k):
+        matched_genres = sorted(preferred.intersection(book.get("genres", [])))
+        reason = (
+            f"Matched your preferred genres: {', '.join(matched_genres)}."
+            if matched_genres
+            else "Similar to the books in your cart and your comment."
+        )
+        out.append(
+            order_details.RecommendedBook(
+                book_id=book["bookId"],
+                title=book["title"],
+                author=book["author"],
+                reason=reason,
+                description=book["description"],
+            )
+        )
+    return out
+
+
+def request_ai_recommendations(
+    cart_titles: list[str], comment: str, preferred_genres: list[str], top_k: int, timeout: float | None = None
+) -> list[order_details.RecommendedBook]:
+    if not open_ai_client:
+        raise RuntimeError("OPENAI_API_KEY is missing.")
+
+    candidates = recommendation_candidates(cart_titles, comment, preferred_genres)
+    options = {} if timeout is None else {"timeout": timeout}
+    response = open_ai_client.responses.create(
+        model=OPENAI_MODEL,
+        input=[{"role": "user", "content": recommendation_prompt(cart_titles, comment, top_k, candidates)}],
+        temperature=0.2,
+        max_output_tokens=400,
+        **options,
+    )
+    return parse_ai_recommendations((response.output_text or "").strip(), cart_titles, top_k, candidates)
+
+
+async def async_request_ai_recommendations(
+    cart_titles: list[str], comment: str, preferred_genres: list[str], top_k: int, timeout: float | None = None
+) -> list[order_details.RecommendedBook]:
+    if not async_llm_client:
+        raise RuntimeError("OPENAI_API_KEY is missing.")
+
+    candidates = recommendation_candidates(cart_titles, comment, preferred_genres)
+    text = await async_llm_client.response_text(
+        recommendation_prompt(cart_titles, comment, top_k, candidates),
+        temperature=0.2,
+        max_output_tokens=400,
+        timeout=timeout,
+    )
+    return parse_ai_recommendations(text, cart_titles, top_k, candidates)
+
+
 class RecommendationService(
     BaseServiceWrapper, recommendation_system_grpc.RecommendationServiceServicer
 ):
     def __init__(self, service_id: int, n_services: int):
         super().__init__(service_id, n_services)
-        self._lock = threading.Lock()
-        self.order_vector_clocks: dict[str, list[int]] = {}
-        self.order_event_data: dict[str, dict[str, Any]] = {}
 
     def _normalize_clock(self, vector_clock: list[int]) -> list[int]:
         normalized = list(vector_clock)
@@ -335,13 +414,7 @@ class RecommendationService(
         return normalized[: self.n_services]
 
     def _touch_event_clock(self, order_id: str, incoming_clock: list[int], event_name: str) -> list[int]:
-        with self._lock:
-            local_clock = self.order_vector_clocks.get(order_id, [0] * self.n_services)
-            merged = [max(local_clock[i], incoming_clock[i]) for i in range(self.n_services)]
-            merged[self.service_id] += 1
-            self.order_vector_clocks[order_id] = merged
-            self.vector_clock = list(merged)
-
+        merged = self._update_vector_clock(order_id, incoming_clock)
         logger.info(f"{event_name} order_id={order_id}, vector_clock={merged}")
         return merged
 
@@ -350,8 +423,7 @@ class RecommendationService(
     ) -> order_details.StatusMessage:
         clock_to_use = vector_clock
         if clock_to_use is None:
-            with self._lock:
-                clock_to_use = list(self.order_vector_clocks.get(order_id, [0] * self.n_services))
+            clock_to_use = self._get_vector_clock(order_id)
         return order_details.StatusMessage(
             success=success,
             order_id=order_id,
@@ -359,36 +431,48 @@ class RecommendationService(
             error_message=error_message,
         )
 
-    def InitTransaction(self, request, context):
-        with self._lock:
-            self.order_details[request.order_id] = request
-            self.order_vector_clocks[request.order_id] = [0] * self.n_services
-            self.order_event_data[request.order_id] = {
+    def _new_order_record(self, order) -> OrderRecord:
+        return OrderRecord(
+            order.order_id,
+            order,
+            self.n_services,
+            event_data={
                 "cart_titles": [],
                 "cart_genres": [],
                 "comment": "",
                 "comment_genres": [],
                 "suggested_books": [],
-            }
+            },
+        )
+
+    def _set_event_data(self, record: OrderRecord, **values: Any) -> None:
+        with record.lock:
+            record.event_data.update(values)
+
+    def _get_event_data(self, record: OrderRecord) -> dict[str, Any]:
+        with record.lock:
+            return dict(record.event_data)
+
+    def InitTransaction(self, request, context):
+        status = super().InitTransaction(request, context)
         logger.info(
             f"InitTransaction order_id={request.order_id}, "
-            f"vector_clock={self.order_vector_clocks[request.order_id]}"
+            f"vector_clock={self._get_vector_clock(request.order_id)}"
         )
-        return self._status(order_id=request.order_id, success=True)
+        return self._status(order_id=status.order_id, success=True)
 
     def ExtractCartSignals(self, request, context):
         order_id = request.order_id
-        with self._lock:
-            data = self.order_details.get(order_id)
+        record = self.orders.get(order_id)
 
-        if data is None:
+        if record is None:
             error_message = f"Order id {order_id} is not found"
             logger.error(error_message)
             status = self._status(order_id=order_id, success=False, error_message=error_message)
             return status
 
         try:
-            cart_titles = [item.name.strip() for item in data.items if item.name]
+            cart_titles = [item.name.strip() for item in record.order.items if item.name]
             cart_genres = _extract_cart_genres(cart_titles)
             event_clock = self._touch_event_clock(
                 order_id=order_id,
@@ -396,9 +480,7 @@ class RecommendationService(
                 event_name="ExtractCartSignals",
             )
 
-            with self._lock:
-                self.order_event_data[order_id]["cart_titles"] = cart_titles
-                self.order_event_data[order_id]["cart_genres"] = cart_genres
+            self._set_event_data(record, cart_titles=cart_titles, cart_genres=cart_genres)
 
             if not cart_titles:
                 return self._status(
@@ -415,15 +497,14 @@ class RecommendationService(
 
     def ExtractCommentSignals(self, request, context):
         order_id = request.order_id
-        with self._lock:
-            data = self.order_details.get(order_id)
-        if data is None:
+        record = self.orders.get(order_id)
+        if record is None:
             error_message = f"Order id {order_id} is not found"
             logger.error(error_message)
             return self._status(order_id=order_id, success=False, error_message=error_message)
 
         try:
-            comment = data.user_comment or ""
+            comment = record.order.user_comment or ""
             comment_genres = _extract_comment_genres(comment)
             event_clock = self._touch_event_clock(
                 order_id=order_id,
@@ -431,9 +512,7 @@ class RecommendationService(
                 event_name="ExtractCommentSignals",
             )
 
-            with self._lock:
-                self.order_event_data[order_id]["comment"] = comment
-                self.order_event_data[order_id]["comment_genres"] = comment_genres
+            self._set_event_data(record, comment=comment, comment_genres=comment_genres)
 
             return self._status(order_id=order_id, success=True, vector_clock=event_clock)
         except Exception as exc:
@@ -441,54 +520,74 @@ class RecommendationService(
             logger.error(error_message)
             return self._status(order_id=order_id, success=False, error_message=error_message)
 
-    def GenerateRecommendations(self, request, context):
-        order_id = request.order_id
-        with self._lock:
-            data = self.order_details.get(order_id)
-            event_data = self.order_event_data.get(order_id)
+    def _generation_inputs(self, request, record: OrderRecord) -> tuple[list[int], list[str], str, list[str]]:
+        """Event clock, cart titles, comment and preferred genres of GenerateRecommendations."""
+        event_clock = self._touch_event_clock(
+            order_id=request.order_id,
+            incoming_clock=self._normalize_clock(request.vector_clock),
+            event_name="GenerateRecommendations",
+        )
 
-        if data is None or event_data is None:
-            error_message = f"Order id {order_id} is not found"
-            logger.error(error_message)
-            return self._status(order_id=order_id, success=False, error_message=error_message)
+        event_data = self._get_event_data(record)
+        cart_titles = list(event_data.get("cart_titles", []))
+        comment = str(event_data.get("comment", ""))
+        preferred_genres = sorted(
+            set(event_data.get("cart_genres", [])).union(event_data.get("comment_genres", []))
+        )
 
-        try:
-            event_clock = self._touch_event_clock(
+        if not cart_titles:
+            cart_titles = [item.name.strip() for item in record.order.items if item.name]
+        return event_clock, cart_titles, comment, preferred_genres
+
+    def _ai_budget(self, context) -> float | None:
+        budget = remaining_budget(context)
+        if budget is not None and budget < AI_RECOMMENDATION_MIN_BUDGET_MS / 1000:
+            raise TimeoutError(f"only {budget:.2f}s of the deadline left, skipping AI")
+        return budget
+
+    def _fallback_books(
+        self, order_id: str, cart_titles: list[str], preferred_genres: list[str], exc: Exception
+    ) -> list[order_details.RecommendedBook]:
+        logger.warning(f"AI recommendation failed for order_id={order_id}: {str(exc)}")
+        if preferred_genres:
+            return _genre_fallback_recommendations(cart_titles, preferred_genres, DEFAULT_TOP_K)
+        return _fallback_recommendations(cart_titles, DEFAULT_TOP_K)
+
+    def _generation_status(
+        self, order_id: str, record: OrderRecord, suggested_books: list[order_details.RecommendedBook], event_clock: list[int]
+    ) -> order_details.StatusMessage:
+        self._set_event_data(record, suggested_books=suggested_books)
+
+        if not suggested_books:
+            return self._status(
                 order_id=order_id,
-                incoming_clock=self._normalize_clock(request.vector_clock),
-                event_name="GenerateRecommendations",
+                success=False,
+                error_message="Recommendation generation produced no books.",
+                vector_clock=event_clock,
             )
 
-            cart_titles = list(event_data.get("cart_titles", []))
-            comment = str(event_data.get("comment", ""))
-            preferred_genres = sorted(
-                set(event_data.get("cart_genres", [])).union(event_data.get("comment_genres", []))
-            )
+        return self._status(order_id=order_id, success=True, vector_clock=event_clock)
 
-            if not cart_titles:
-                cart_titles = [item.name.strip() for item in data.items if item.name]
-
-            try:
-                suggested_books = request_ai_recommendations(cart_titles, comment, DEFAULT_TOP_K)
-            except Exception as exc:
-                logger.warning(f"AI recommendation failed for order_id={order_id}: {str(exc)}")
-                if preferred_genres:
-                    suggested_books = _genre_fallback_recommendations(cart_titles, preferred_genres, DEFAULT_TOP_K)
-                else:
-                    suggested_books = _fallback_recommendations(cart_titles, DEFAULT_TOP_K)
-
-            with self._lock:
-                self.order_event_data[order_id]["suggested_books"] = suggested_books
+    def GenerateRecommendations(self, request, context):
+        order_id = request.order_id
+        record = self.orders.get(order_id)
 
-            if not suggested_books:
-                return self._status(
-                    order_id=order_id,
-                    success=False,
-                    error_message="Recommendation generation produced no books.",
-                    vector_clock=event_clock,
-                )
+        if record is None:
+            error_message = f"Order id {order_id} is not found"
+            logger.error(error_message)
+            return self._status(order_id=order_id, success=False, error_message=error_message)
 
-            return self._status(order_id=order_id, success=True, vector_clock=event_clock)
+        try:
+            event_clock, cart_titles, comment, preferred_genres = self._generation_inputs(request, record)
+            if VECTOR_RECOMMENDER is not None:
+                suggested_books = vector_recommendations(cart_titles, comment, preferred_genres, DEFAULT_TOP_K)
+            else:
+                try:
+                    budget = self._ai_budget(context)
+                    suggested_books = request_ai_recommendations(cart_titles, comment, preferred_genres, DEFAULT_TOP_K, timeout=budget)
+                except Exception as exc:
+                    suggested_books = self._fallback_books(order_id, cart_titles, preferred_genres, exc)
+            return self._generation_status(order_id, record, suggested_books, event_clock)
         except Exception as exc:
             error_message = f"GenerateRecommendations failed: {str(exc)}"
             logger.error(error_message)
@@ -496,11 +595,9 @@ class RecommendationService(
 
     def ValidateRecommendations(self, request, context):
         order_id = request.order_id
-        with self._lock:
-            data = self.order_details.get(order_id)
-            event_data = self.order_event_data.get(order_id)
+        record = self.orders.get(order_id)
 
-        if data is None or event_data is None:
+        if record is None:
             error_message = f"Order id {order_id} is not found"
             logger.error(error_message)
             return self._status(order_id=order_id, success=False, error_message=error_message)
@@ -512,8 +609,8 @@ class RecommendationService(
                 event_name="ValidateRecommendations",
             )
 
-            cart_titles = {item.name.strip().lower() for item in data.items if item.name}
-            raw_books: list[order_details.RecommendedBook] = list(event_data.get("suggested_books", []))
+            cart_titles = {item.name.strip().lower() for item in record.order.items if item.name}
+            raw_books: list[order_details.RecommendedBook] = list(self._get_event_data(record).get("suggested_books", []))
             seen_ids = set()
             valid_books: list[order_details.RecommendedBook] = []
             for book in raw_books:
@@ -532,8 +629,7 @@ class RecommendationService(
                 if len(valid_books) >= DEFAULT_TOP_K:
                     break
 
-            with self._lock:
-                self.order_event_data[order_id]["suggested_books"] = valid_books
+            self._set_event_data(record, suggested_books=valid_books)
 
             if not valid_books:
                 return self._status(
@@ -559,31 +655,10 @@ class RecommendationService(
                 error_message=f"{key} thread failed: {str(exc)}",
             )
 
-    def GetRecommendations(self, request, context):
-        order_id = request.order_id
-        with self._lock:
-            data = self.order_details.get(order_id)
-
-        if data is None:
-            status = self._status(
-                order_id=order_id,
-                success=False,
-                error_message=f"Order id {order_id} is not found",
-            )
-            result = order_details.OrderResponce()
-            result.status.CopyFrom(status)
-            return result
-
-        start_clock = self._touch_event_clock(
-            order_id=order_id,
-            incoming_clock=self._normalize_clock(request.vector_clock),
-            event_name="GetRecommendations",
-        )
-
+    def _run_signal_events(
+        self, cart_req: order_details.OperationalMessage, comment_req: order_details.OperationalMessage
+    ) -> dict[str, order_details.StatusMessage]:
         result_container: dict[str, order_details.StatusMessage] = {}
-        cart_req = order_details.OperationalMessage(order_id=order_id, vector_clock=start_clock)
-        comment_req = order_details.OperationalMessage(order_id=order_id, vector_clock=start_clock)
-
         event_cart = threading.Thread(
             target=self._run_event_thread,
             kwargs={
@@ -606,6 +681,36 @@ class RecommendationService(
         event_comment.start()
         event_cart.join()
         event_comment.join()
+        return result_container
+
+    def _failed_response(self, status: order_details.StatusMessage) -> order_details.OrderResponce:
+        result = order_details.OrderResponce()
+        result.status.CopyFrom(status)
+        return result
+
+    def _start_recommendations(self, request, context) -> tuple[order_details.OperationalMessage | None, order_details.OrderResponce | None]:
+        """Runs the signal events; returns the GenerateRecommendations request, or the response if they failed."""
+        order_id = request.order_id
+        self._init_transaction_from_message(request, context)
+        record = self.orders.get(order_id)
+
+        if record is None:
+            status = self._status(
+                order_id=order_id,
+                success=False,
+                error_message=f"Order id {order_id} is not found",
+            )
+            return None, self._failed_response(status)
+
+        start_clock = self._touch_event_clock(
+            order_id=order_id,
+            incoming_clock=self._normalize_clock(request.vector_clock),
+            event_name="GetRecommendations",
+        )
+
+        cart_req = order_details.OperationalMessage(order_id=order_id, vector_clock=start_clock)
+        comment_req = order_details.OperationalMessage(order_id=order_id, vector_clock=start_clock)
+        result_container = self._run_signal_events(cart_req, comment_req)
 
         if any(not result_container[key].success for key in result_container):
             error_message = "; ".join(
@@ -614,30 +719,27 @@ class RecommendationService(
                 if not result_container[key].success
             )
             status = self._status(order_id=order_id, success=False, error_message=error_message)
-            result = order_details.OrderResponce()
-            result.status.CopyFrom(status)
-            return result
+            return None, self._failed_response(status)
 
         gen_req = order_details.OperationalMessage(
             order_id=order_id, vector_clock=self._status(order_id, True).vector_clock
         )
-        gen_status = self.GenerateRecommendations(gen_req, context)
+        return gen_req, None
+
+    def _finish_recommendations(self, request, context, gen_status: order_details.StatusMessage) -> order_details.OrderResponce:
+        order_id = request.order_id
         if not gen_status.success:
-            result = order_details.OrderResponce()
-            result.status.CopyFrom(gen_status)
-            return result
+            return self._failed_response(gen_status)
 
         validate_req = order_details.OperationalMessage(
             order_id=order_id, vector_clock=gen_status.vector_clock
         )
         validate_status = self.ValidateRecommendations(validate_req, context)
         if not validate_status.success:
-            result = order_details.OrderResponce()
-            result.status.CopyFrom(validate_status)
-            return result
+            return self._failed_response(validate_status)
 
-        with self._lock:
-            suggested_books = list(self.order_event_data.get(order_id, {}).get("suggested_books", []))
+        record = self.orders.get(order_id)
+        suggested_books = list(self._get_event_data(record).get("suggested_books", [])) if record is not None else []
 
         success_status = self._status(
             order_id=order_id,
@@ -653,11 +755,22 @@ class RecommendationService(
         )
         return result
 
+    def GetRecommendations(self, request, context):
+        gen_req, failed = self._start_recommendations(request, context)
+        if failed is not None:
+            return failed
+        return self._finish_recommendations(request, context, self.GenerateRecommendations(gen_req, context))
+
     def ClearTransaction(self, request, context):
         order_id = request.order_id
         incoming_clock = self._normalize_clock(request.vector_clock)
-        with self._lock:
-            local_clock = list(self.order_vector_clocks.get(order_id, [0] * self.n_services))
+        known_order = order_id in self.orders
+        local_clock = self._get_vector_clock(order_id)
+
+        if not known_order:
+            # In the fused flow the order only reaches this service when fraud checks pass
+            logger.info(f"ClearTransaction order_id={order_id} skipped, order is not known")
+            return order_details.StatusMessage(success=True, order_id=order_id, vector_clock=incoming_clock)
 
         can_clear = all(local_clock[i] <= incoming_clock[i] for i in range(self.n_services))
         if not can_clear:
@@ -673,13 +786,7 @@ class RecommendationService(
             incoming_clock=incoming_clock,
             event_name="ClearTransaction",
         )
-        with self._lock:
-            if order_id in self.order_details:
-                del self.order_details[order_id]
-            if order_id in self.order_event_data:
-                del self.order_event_data[order_id]
-            if order_id in self.order_vector_clocks:
-                del self.order_vector_clocks[order_id]
+        self.orders.pop(order_id)
 
         logger.info(
             f"ClearTransaction order_id={order_id}, final_vector_clock={incoming_clock}, "
@@ -688,7 +795,74 @@ class RecommendationService(
         return order_details.StatusMessage(success=True, order_id=order_id, vector_clock=clear_clock)
 
 
+class AsyncRecommendationService(RecommendationService):
+    """
+    Recommendation system on a grpc.aio server. The AI call is awaited, so pending LLM calls
+    hold no thread; the other events take microseconds and stay synchronous.
+    """
+
+    def _run_signal_events(
+        self, cart_req: order_details.OperationalMessage, comment_req: order_details.OperationalMessage
+    ) -> dict[str, order_details.StatusMessage]:
+        # Both events only read the order, one after the other on the event loop is cheaper than two threads
+        result_container: dict[str, order_details.StatusMessage] = {}
+        self._run_event_thread(self.ExtractCartSignals, cart_req, result_container, "ExtractCartSignals")
+        self._run_event_thread(self.ExtractCommentSignals, comment_req, result_container, "ExtractCommentSignals")
+        return result_container
+
+    async def GenerateRecommendations(self, request, context):
+        order_id = request.order_id
+        record = self.orders.get(order_id)
+
+        if record is None:
+            error_message = f"Order id {order_id} is not found"
+            logger.error(error_message)
+            return self._status(order_id=order_id, success=False, error_message=error_message)
+
+        try:
+            event_clock, cart_titles, comment, preferred_genres = self._generation_inputs(request, record)
+            if VECTOR_RECOMMENDER is not None:
+                suggested_books = vector_recommendations(cart_titles, comment, preferred_genres, DEFAULT_TOP_K)
+            else:
+                try:
+                    budget = self._ai_budget(context)
+                    suggested_books = await async_request_ai_recommendations(cart_titles, comment, preferred_genres, DEFAULT_TOP_K, timeout=budget)
+                except Exception as exc:
+                    suggested_books = self._fallback_books(order_id, cart_titles, preferred_genres, exc)
+            return self._generation_status(order_id, record, suggested_books, event_clock)
+        except Exception as exc:
+            error_message = f"GenerateRecommendations failed: {str(exc)}"
+            logger.error(error_message)
+            return self._status(order_id=order_id, success=False, error_message=error_message)
+
+    async def GetRecommendations(self, request, context):
+        gen_req, failed = self._start_recommendations(request, context)
+        if failed is not None:
+            return failed
+        return self._finish_recommendations(request, context, await self.GenerateRecommendations(gen_req, context))
+
+
+async def serve_aio():
+    # Synchronous handlers run on the migration thread pool
+    server = grpc.aio.server(migration_thread_pool=futures.ThreadPoolExecutor())
+    recommendation_system_grpc.add_RecommendationServiceServicer_to_server(
+        AsyncRecommendationService(2, 3), server
+    )
+    port = "50053"
+    server.add_insecure_port("[::]:" + port)
+    await server.start()
+    logger.info(f"Server started in aio mode. Listening on port {port}.")
+    try:
+        await server.wait_for_termination()
+    finally:
+        if async_llm_client is not None:
+            await async_llm_client.close()
+
+
 def serve():
+    if GRPC_SERVER_MODE == "aio":
+        asyncio.run(serve_aio())
+        return
     server = grpc.server(futures.ThreadPoolExecutor())
     recommendation_system_grpc.add_RecommendationServiceServicer_to_server(
         RecommendationService(2, 3), server
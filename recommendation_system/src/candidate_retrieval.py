@@ -0,0 +1,67 @@
+import re
+from typing import Any, Iterable
+
+from catalog_index import CatalogIndex
+
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Words that say nothing about what a reader likes
+STOP_WORDS = {
+    "the", "and", "for", "with", "about", "from", "that", "this", "into", "its", "his", "her",
+    "you", "your", "book", "books", "like", "love", "want", "some", "more", "please", "read",
+}
+MAX_DESCRIPTION_CHARS = 160
+
+
+def tokenize(text: str) -> set[str]:
+    return {word for word in _WORD.findall((text or "").lower()) if len(word) > 2 and word not in STOP_WORDS}
+
+
+def compact_record(book: dict[str, Any]) -> dict[str, Any]:
+    """The fields of a book the LLM needs to pick and describe it."""
+    description = str(book.get("description", ""))
+    if len(description) > MAX_DESCRIPTION_CHARS:
+        description = description[: MAX_DESCRIPTION_CHARS - 3].rstrip() + "..."
+    return {
+        "bookId": book["bookId"],
+        "title": book["title"],
+        "author": book["author"],
+        "genres": list(book.get("genres", [])),
+        "description": description,
+    }
+
+
+class CandidateIndex:
+    """
+    Local preselection of the books worth showing to the LLM.
+
+    A book scores GENRE_WEIGHT per preferred genre it has plus one per word it shares with
+    the cart titles and user comment (title, author, genres and description words). Ties
+    keep the catalog order, and books already in the cart are never candidates.
+    """
+
+    GENRE_WEIGHT = 2
+
+    def __init__(self, catalog: CatalogIndex):
+        self.catalog = catalog
+        self.books = catalog.books
+        self._tokens = [
+            tokenize(" ".join([book["title"], book["author"], book.get("description", ""), *book.get("genres", [])]))
+            for book in self.books
+        ]
+
+    def top_candidates(
+        self, cart_titles: list[str], comment: str, preferred_genres: Iterable[str], n: int
+    ) -> list[dict[str, Any]]:
+        cart_positions = self.catalog.title_positions(cart_titles)
+        preferred = set(preferred_genres)
+        query = tokenize(" ".join([*cart_titles, comment or ""]))
+
+        scored = []
+        for position, (book, tokens) in enumerate(zip(self.books, self._tokens)):
+            if position in cart_positions:
+                continue
+            score = self.GENRE_WEIGHT * len(preferred.intersection(book.get("genres", []))) + len(query & tokens)
+            scored.append((-score, position))
+        scored.sort()
+        return [self.books[position] for _, position in scored[:n]]
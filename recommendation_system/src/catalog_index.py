@@ -0,0 +1,80 @@
+import heapq
+from typing import Any, Iterable
+
+
+def normalize_title(title: str) -> str:
+    return (title or "").strip().lower()
+
+
+class CatalogIndex:
+    """
+    Book catalog compiled for per-order lookups that do not scan it.
+
+    Shared by the fallbacks, candidate retrieval and the vector engine, so titles are
+    normalized the same way everywhere. Holds normalized title -> book positions,
+    genre -> sorted posting list of book positions, and the lowercase title of every book.
+    Lookups cost O(cart size) and genre ranking O(postings of the preferred genres),
+    whatever the catalog size.
+    """
+
+    def __init__(self, catalog: Iterable[dict[str, Any]]):
+        self.books = list(catalog)
+        self.by_id = {book["bookId"]: book for book in self.books}
+        self.position_by_id = {book["bookId"]: position for position, book in enumerate(self.books)}
+        self.lower_titles = [normalize_title(book["title"]) for book in self.books]
+
+        self.positions_by_title: dict[str, list[int]] = {}
+        self.genre_postings: dict[str, list[int]] = {}
+        for position, book in enumerate(self.books):
+            self.positions_by_title.setdefault(self.lower_titles[position], []).append(position)
+            for genre in set(book.get("genres", [])):
+                self.genre_postings.setdefault(genre, []).append(position)
+        # Order in which books without any preferred genre fill up a ranking
+        self._by_id_descending = sorted(range(len(self.books)), key=lambda position: self.books[position]["bookId"], reverse=True)
+
+    def title_positions(self, titles: Iterable[str]) -> set[int]:
+        """Positions of the catalog books with one of the titles."""
+        return {
+            position
+            for title in titles
+            if title
+            for position in self.positions_by_title.get(normalize_title(title), ())
+        }
+
+    def genres_of_titles(self, titles: Iterable[str]) -> list[str]:
+        return sorted({genre for position in self.title_positions(titles) for genre in self.books[position].get("genres", [])})
+
+    def first_books(self, exclude_titles: Iterable[str], k: int) -> list[dict[str, Any]]:
+        """The first k books of the catalog without the excluded titles."""
+        excluded = self.title_positions(exclude_titles)
+        out = []
+        for position, book in enumerate(self.books):
+            if len(out) >= k:
+                break
+            if position not in excluded:
+                out.append(book)
+        return out
+
+    def top_by_genre_overlap(
+        self, preferred_genres: Iterable[str], exclude_titles: Iterable[str], k: int
+    ) -> list[tuple[int, dict[str, Any]]]:
+        """
+        (overlap, book) of the k books sharing the most preferred genres, ties by descending
+        book id; books without a preferred genre fill the ranking up to k in the same order.
+        """
+        excluded = self.title_positions(exclude_titles)
+        overlaps: dict[int, int] = {}
+        for genre in set(preferred_genres):
+            for position in self.genre_postings.get(genre, ()):
+                if position not in excluded:
+                    overlaps[position] = overlaps.get(position, 0) + 1
+
+        ranked = heapq.nlargest(k, overlaps.items(), key=lambda item: (item[1], self.books[item[0]]["bookId"]))
+        out = [(overlap, self.books[position]) for position, overlap in ranked]
+        if len(out) < k:
+            for position in self._by_id_descending:
+                if len(out) >= k:
+                    break
+                if position not in excluded and position not in overlaps:
+                    out.append((0, self.books[position]))
+        return out
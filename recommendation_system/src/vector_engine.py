@@ -0,0 +1,159 @@
+import math
+import re
+import zlib
+from typing import Any, Iterable
+
+import numpy as np
+
+from candidate_retrieval import STOP_WORDS
+from catalog_index import CatalogIndex
+
+
+_WORD = re.compile(r"[a-z0-9]+")
+GENRE_PREFIX = "genre:"
+
+
+def _words(text: str) -> list[str]:
+    return [word for word in _WORD.findall((text or "").lower()) if len(word) > 2 and word not in STOP_WORDS]
+
+
+def terms(text: str) -> list[str]:
+    """Word unigrams and bigrams of the text, without stop words."""
+    words = _words(text)
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def genre_terms(genres: Iterable[str]) -> list[str]:
+    return [GENRE_PREFIX + genre.lower() for genre in genres]
+
+
+class VectorRecommender:
+    """
+    Books ranked by cosine similarity of hashed TF-IDF vectors.
+
+    Title, author, description and genre terms of every book are hashed into `n_features`
+    feature columns, and the hash also picks a sign so that colliding terms cancel out
+    instead of adding up. Genre terms count `genre_weight` times, and rows are L2-normalized.
+    A book has a few dozen terms, so the matrix is stored sparse, column by column (CSC):
+    the posting list of a feature holds the books that have it and their weights. A query
+    only has a few features, its scores add up their posting lists, so it reads the books
+    sharing a term with the query rather than the whole catalog, and `argpartition` picks
+    the top-k among the books that scored. The ranking is exact by default; with
+    `max_postings` set, features of more books than that are left out of the posting lists,
+    which bounds the work of a query whatever the catalog size but approximates the ranking.
+    """
+
+    def __init__(
+        self, catalog: CatalogIndex, n_features: int = 2**18, genre_weight: int = 2, max_postings: int | None = None
+    ):
+        self.catalog = catalog
+        self.books = catalog.books
+        self.n_features = n_features
+        self.genre_weight = genre_weight
+        self.max_postings = max_postings
+
+        # Catalog terms repeat a lot, each is hashed once per build
+        term_features: dict[str, tuple[int, int]] = {}
+        rows, columns, counts = [], [], []
+        for row, book in enumerate(self.books):
+            for column, count in self._feature_counts(self._book_terms(book), term_features).items():
+                if count:
+                    rows.append(row)
+                    columns.append(column)
+                    counts.append(count)
+        rows = np.array(rows, dtype=np.int32)
+        columns = np.array(columns, dtype=np.int64)
+        values = np.array(counts, dtype=np.float32)
+
+        # Smoothed idf, features present in every book still weigh a little
+        document_frequency = np.bincount(columns, minlength=n_features)
+        self.idf = (np.log((1 + len(self.books)) / (1 + document_frequency)) + 1).astype(np.float32)
+        values *= self.idf[columns]
+        row_norms = np.sqrt(np.bincount(rows, weights=np.square(values, dtype=np.float64), minlength=len(self.books)))
+        values /= np.maximum(row_norms, 1e-12)[rows].astype(np.float32)
+
+        if max_postings is not None:
+            # Features of more than max_postings books act as stop words of the catalog: they weigh
+            # little and would make every query read a large part of it, so they get no posting list
+            indexed = document_frequency[columns] <= max_postings
+            rows, columns, values = rows[indexed], columns[indexed], values[indexed]
+        order = np.argsort(columns, kind="stable")
+        self.indices = rows[order]
+        self.data = values[order]
+        self.indptr = np.zeros(n_features + 1, dtype=np.int64)
+        np.cumsum(np.bincount(columns, minlength=n_features), out=self.indptr[1:])
+
+    @property
+    def nbytes(self) -> int:
+        return self.indices.nbytes + self.data.nbytes + self.indptr.nbytes + self.idf.nbytes
+
+    def _book_terms(self, book: dict[str, Any]) -> list[str]:
+        text = " ".join((book["title"], book["author"], book.get("description", "")))
+        return terms(text) + genre_terms(book.get("genres", [])) * self.genre_weight
+
+    def _term_feature(self, term: str) -> tuple[int, int]:
+        """Feature column and sign of the term."""
+        term_hash = zlib.crc32(term.encode("utf-8"))
+        return term_hash % self.n_features, 1 if term_hash >> 31 else -1
+
+    def _feature_counts(self, book_terms: Iterable[str], term_features: dict[str, tuple[int, int]] | None = None) -> dict[int, int]:
+        """Signed term counts per hashed feature column, `term_features` memoizes the hashing."""
+        counts: dict[int, int] = {}
+        for term in book_terms:
+            feature = term_features.get(term) if term_features is not None else None
+            if feature is None:
+                feature = self._term_feature(term)
+                if term_features is not None:
+                    term_features[term] = feature
+            column, sign = feature
+            counts[column] = counts.get(column, 0) + sign
+        return counts
+
+    def query_vector(self, cart_titles: list[str], comment: str, preferred_genres: Iterable[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Active feature columns of the cart and comment signals and their TF-IDF weights."""
+        query_terms = terms(" ".join([*cart_titles, comment or ""]))
+        cart_genres = [
+            genre
+            for title in cart_titles
+            for position in self.catalog.title_positions([title])
+            for genre in self.books[position].get("genres", [])
+        ]
+        query_terms += genre_terms([*preferred_genres, *cart_genres]) * self.genre_weight
+
+        counts = self._feature_counts(query_terms)
+        columns = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        weights = np.fromiter(counts.values(), dtype=np.float32, count=len(counts)) * self.idf[columns]
+        norm = math.sqrt(float(weights @ weights))
+        return columns, weights / norm if norm else weights
+
+    def scores(self, columns: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Similarity of every book, from the posting lists of the active features only."""
+        # Features left out by max_postings have empty posting lists, bincount of nothing would return ints
+        postings = [
+            (self.indptr[column], self.indptr[column + 1], weight)
+            for column, weight in zip(columns, weights)
+            if weight and self.indptr[column + 1] > self.indptr[column]
+        ]
+        if not postings:
+            return np.zeros(len(self.books))
+        rows = np.concatenate([self.indices[start:end] for start, end, _ in postings])
+        values = np.concatenate([self.data[start:end] * weight for start, end, weight in postings])
+        return np.bincount(rows, weights=values, minlength=len(self.books))
+
+    def top_k(self, cart_titles: list[str], comment: str, preferred_genres: Iterable[str], k: int) -> list[tuple[dict[str, Any], float]]:
+        """The k most similar books not in the cart, best first, with their similarity."""
+        if not self.books or k <= 0:
+            return []
+        scores = self.scores(*self.query_vector(cart_titles, comment, preferred_genres))
+        for position in self.catalog.title_positions(cart_titles):
+            scores[position] = -np.inf
+
+        k = min(k, len(self.books))
+        # Books sharing no term with the query score 0, they only matter when fewer than k scored
+        top = np.flatnonzero(scores > 0)
+        if len(top) < k:
+            top = np.arange(len(self.books))
+        top = top[np.argpartition(scores[top], -k)[-k:]]
+        # Best first, ties in catalog order
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(self.books[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
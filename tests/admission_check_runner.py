@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Checks that checkout admission control sheds load with 429 in the running orchestrator.
+
+Sends a burst of concurrent checkouts, more than the concurrency limit plus the admission
+queue, and exits with 1 unless at least one of them is rejected with 429 and Retry-After.
+Start the orchestrator with a small queue and slow backends, for example:
+
+    ADMISSION_MAX_QUEUE_DEPTH=2 docker compose up
+    python tests/admission_check_runner.py --requests 40
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+
+import httpx
+
+
+BASE_URL = "http://localhost:8081"
+TIMEOUT_SEC = 120
+
+
+def checkout_payload(request_id: int) -> dict:
+    return {
+        "user": {
+            "name": f"AdmissionUser-{request_id}",
+            "contact": f"admission.{request_id}@example.com",
+        },
+        "creditCard": {"number": "4111111111111111", "expirationDate": "12/27", "cvv": "123"},
+        "userComment": f"Admission check request={request_id}.",
+        "items": [{"name": "Book A", "quantity": 1}],
+        "billingAddress": {
+            "street": "123 Main St",
+            "city": "Springfield",
+            "state": "IL",
+            "zip": "62701",
+            "country": "USA",
+        },
+        "shippingMethod": "Standard",
+        "giftWrapping": False,
+        "termsAccepted": True,
+    }
+
+
+async def run_checkout(client: httpx.AsyncClient, url: str, request_id: int, start: asyncio.Event) -> httpx.Response:
+    await start.wait()
+    return await client.post(url, json=checkout_payload(request_id))
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--requests", type=int, default=120)
+    args = parser.parse_args()
+
+    start = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.requests, max_keepalive_connections=0)
+    async with httpx.AsyncClient(timeout=TIMEOUT_SEC, limits=limits) as client:
+        tasks = [
+            asyncio.create_task(run_checkout(client, f"{args.base_url}/checkout", request_id, start))
+            for request_id in range(args.requests)
+        ]
+        await asyncio.sleep(0)
+        start.set()
+        responses = await asyncio.gather(*tasks)
+
+    statuses = Counter(response.status_code for response in responses)
+    print(f"Status codes of {args.requests} concurrent checkouts: {dict(sorted(statuses.items()))}")
+
+    rejected = [response for response in responses if response.status_code == 429]
+    if not rejected:
+        print("FAIL: no checkout was rejected with 429")
+        return 1
+    if any("retry-after" not in response.headers for response in rejected):
+        print("FAIL: a 429 response has no Retry-After header")
+        return 1
+    print(f"OK: {len(rejected)} checkouts rejected with 429")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,141 @@
+"""Vectorized batch checks of transaction_verification against the per-order rules."""
+import datetime
+import os
+import random
+import sys
+from collections import namedtuple
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../transaction_verification/src"))
+
+from batch_validation import (
+    validate_card_numbers,
+    validate_card_vendors,
+    validate_cvvs,
+    validate_expiration_dates,
+    validate_order_lists,
+)
+from bin_table import BinTable, MAX_CARD_LENGTH, MIN_CARD_LENGTH
+
+
+BIN_RANGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../transaction_verification/src/bin_ranges.csv")
+TODAY = datetime.date(2026, 3, 15)
+Item = namedtuple("Item", "name quantity")
+
+
+# Reference rules, as validate_credit_card & co. apply them to one order in transaction_verification/src/app.py
+
+def reference_card_number(card_number):
+    if not MIN_CARD_LENGTH <= len(card_number) <= MAX_CARD_LENGTH or not card_number.isdigit():
+        return False
+    digits = [int(num) for num in card_number]
+    check_digit = digits.pop(-1)
+    digits.reverse()
+    digits = [num * 2 if idx % 2 == 0 else num for idx, num in enumerate(digits)]
+    digits = [num - 9 if idx % 2 == 0 and num > 9 else num for idx, num in enumerate(digits)]
+    return (sum(digits) + check_digit) % 10 == 0
+
+
+def reference_card_vendor(card_number, table, accepted_networks):
+    card_range = table.lookup(card_number)
+    if card_range is None:
+        return False
+    return card_range.network in accepted_networks and len(card_number) in card_range.lengths
+
+
+def reference_expiration_date(in_date, today):
+    try:
+        expr_month = in_date.split("/")[0].strip()
+        expr_year = in_date.split("/")[1].strip()
+        if len(expr_month) == 1:
+            expr_month = f"0{expr_month}"
+        if len(expr_year) == 2:
+            expr_year = f"20{expr_year}"
+        if len(expr_month) != 2 or len(expr_year) != 4:
+            return False
+        expr_month, expr_year = int(expr_month), int(expr_year)
+    except (IndexError, ValueError):
+        return False
+    if expr_month < 1 or expr_month > 12:
+        return False
+    next_expr_date = datetime.date(expr_year + 1, 1, 1) if expr_month == 12 else datetime.date(expr_year, expr_month + 1, 1)
+    return today < next_expr_date and (next_expr_date - today).days <= 365 * 3
+
+
+def reference_cvv(cvv):
+    return len(cvv) == 3 and cvv.isdigit()
+
+
+def reference_order_list(items):
+    return len(items) > 0 and all(0 <= item.quantity <= 100 and len(item.name) > 0 for item in items)
+
+
+def with_luhn_digit(prefix):
+    for check_digit in "0123456789":
+        if reference_card_number(prefix + check_digit):
+            return prefix + check_digit
+    raise AssertionError(prefix)
+
+
+def random_card_numbers(rng, n):
+    numbers = ["", "4111111111111111", "4111111111111112", "0000000000000", "4111 1111 1111 1111", "41111111111111111111"]
+    while len(numbers) < n:
+        length = rng.randint(MIN_CARD_LENGTH - 2, MAX_CARD_LENGTH + 1)
+        prefix = rng.choice(["4", "51", "55", "2221", "34", "37", "6011", "9"])
+        body = prefix + "".join(rng.choice("0123456789") for _ in range(max(length - len(prefix) - 1, 0)))
+        well_sized = MIN_CARD_LENGTH <= len(body) + 1 <= MAX_CARD_LENGTH
+        numbers.append(with_luhn_digit(body) if well_sized and rng.random() < 0.5 else body + rng.choice("0123456789x"))
+    return numbers
+
+
+@pytest.fixture(scope="module")
+def bin_table():
+    return BinTable.load(BIN_RANGES_PATH)
+
+
+def test_card_numbers_match_the_luhn_rule():
+    numbers = random_card_numbers(random.Random(13), 2000)
+    assert validate_card_numbers(numbers).tolist() == [reference_card_number(number) for number in numbers]
+
+
+@pytest.mark.parametrize("accepted_networks", [frozenset({"visa", "mastercard"}), frozenset({"amex"}), frozenset()])
+def test_card_vendors_match_the_bin_table_lookup(bin_table, accepted_networks):
+    numbers = random_card_numbers(random.Random(14), 2000)
+    expected = [reference_card_vendor(number, bin_table, accepted_networks) for number in numbers]
+    assert validate_card_vendors(numbers, bin_table, accepted_networks).tolist() == expected
+
+
+def test_card_vendors_with_an_empty_table():
+    assert validate_card_vendors(["4111111111111111"], BinTable(), {"visa"}).tolist() == [False]
+
+
+def test_expiration_dates_match_the_per_order_rule():
+    rng = random.Random(15)
+    dates = ["", "12", "1/27", "13/27", "00/27", "02/2026", "03/2026", "04/2026", "03/29", "04/29", "ab/27", "12/99"]
+    dates += [f"{rng.randint(0, 13)}/{rng.choice([rng.randint(20, 35), rng.randint(2020, 2035)])}" for _ in range(1000)]
+    expected = [reference_expiration_date(in_date, TODAY) for in_date in dates]
+    assert validate_expiration_dates(dates, today=TODAY).tolist() == expected
+
+
+def test_cvvs():
+    cvvs = ["123", "12", "1234", "", "12a", " 12", "000"]
+    assert validate_cvvs(cvvs).tolist() == [reference_cvv(cvv) for cvv in cvvs]
+
+
+def test_order_lists_match_the_per_order_rule():
+    rng = random.Random(16)
+    orders_items = [[], [Item("", 1)], [Item("Book", -1)], [Item("Book", 101)], [Item("Book", 100), Item("Other", 0)]]
+    for _ in range(500):
+        orders_items.append([
+            Item(rng.choice(["", "Book A", "Dune"]), rng.randint(-2, 102))
+            for _ in range(rng.randint(0, 4))
+        ])
+    expected = [reference_order_list(items) for items in orders_items]
+    assert validate_order_lists(orders_items).tolist() == expected
+
+
+def test_empty_batches():
+    assert len(validate_card_numbers([])) == 0
+    assert len(validate_cvvs([])) == 0
+    assert len(validate_order_lists([])) == 0
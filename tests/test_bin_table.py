@@ -0,0 +1,84 @@
+"""BinTable interval compilation against a scan over every range."""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../transaction_verification/src"))
+
+from bin_table import BinRange, BinTable, KEY_DIGITS
+
+
+def reference_lookup(ranges, card_number):
+    """Narrowest range covering the card's key, the earliest starting one on ties."""
+    if len(card_number) < KEY_DIGITS or not card_number[:KEY_DIGITS].isdigit():
+        return None
+    key = int(card_number[:KEY_DIGITS])
+    covering = [(high - low, low, index, entry) for index, (low, high, entry) in enumerate(ranges) if low <= key <= high]
+    return min(covering)[3] if covering else None
+
+
+def random_ranges(rng, n):
+    ranges = []
+    for i in range(n):
+        low = rng.randrange(10**KEY_DIGITS)
+        high = min(low + rng.choice([0, 10, 10**3, 10**5, 10**7]), 10**KEY_DIGITS - 1)
+        ranges.append((low, high, BinRange(f"network{i}", frozenset({16}))))
+    return ranges
+
+
+def card_number_with_key(key):
+    return f"{key:0{KEY_DIGITS}d}00000000"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_lookup_matches_the_narrowest_covering_range(seed):
+    rng = random.Random(seed)
+    ranges = random_ranges(rng, 60)
+    table = BinTable(ranges)
+
+    keys = [rng.randrange(10**KEY_DIGITS) for _ in range(2000)]
+    # Boundaries are where the sweep can go wrong
+    for low, high, _ in ranges:
+        keys += [max(low - 1, 0), low, high, min(high + 1, 10**KEY_DIGITS - 1)]
+    for key in keys:
+        card_number = card_number_with_key(key)
+        assert table.lookup(card_number) is reference_lookup(ranges, card_number), key
+
+
+def test_intervals_are_sorted_and_disjoint():
+    table = BinTable(random_ranges(random.Random(7), 200))
+    assert all(start <= end for start, end in zip(table.starts, table.ends))
+    assert all(end < next_start for end, next_start in zip(table.ends, table.starts[1:]))
+
+
+def test_single_bin_overrides_its_network_range():
+    visa, private = BinRange("visa", frozenset({16})), BinRange("private", frozenset({16}))
+    table = BinTable([(40000000, 49999999, visa), (41111111, 41111111, private)])
+    assert table.lookup("4111111111111111") is private
+    assert table.lookup("4111111211111111") is visa
+    assert table.lookup("5111111111111111") is None
+
+
+@pytest.mark.parametrize("card_number", ["", "4111", "4111x1111111111", " 4111111111111111"])
+def test_malformed_numbers_are_not_found(card_number):
+    table = BinTable([(0, 10**KEY_DIGITS - 1, BinRange("any", frozenset({16})))])
+    assert table.lookup(card_number) is None
+
+
+def test_load_expands_prefixes_and_lengths(tmp_path):
+    path = tmp_path / "bin_ranges.csv"
+    path.write_text("network,prefix_start,prefix_end,lengths\nMastercard,2221,2720,16\ndiners,300,305,14-16|19\n")
+    table = BinTable.load(str(path))
+    assert table.lookup("2221000000000000").network == "mastercard"
+    assert table.lookup("2720999999999999").network == "mastercard"
+    assert table.lookup("2721000000000000") is None
+    assert table.lookup("30599999000000").lengths == frozenset({14, 15, 16, 19})
+
+
+def test_load_rejects_inverted_ranges(tmp_path):
+    path = tmp_path / "bin_ranges.csv"
+    path.write_text("network,prefix_start,prefix_end,lengths\nvisa,5,4,16\n")
+    with pytest.raises(ValueError):
+        BinTable.load(str(path))
@@ -0,0 +1,60 @@
+"""Aho-Corasick KeywordMatcher against substring search over every keyword."""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../utils"))
+
+from other.keyword_matcher import KeywordMatcher
+
+
+def reference_match(keywords, text):
+    """Labels with a keyword in the text, in the order the labels first appear."""
+    text = (text or "").lower()
+    labels = []
+    for label, keyword in keywords:
+        keyword = keyword.strip().lower()
+        if keyword and keyword in text and label not in labels:
+            labels.append(label)
+    order = list(dict.fromkeys(label for label, keyword in keywords if keyword.strip()))
+    return sorted(labels, key=order.index)
+
+
+def random_word(rng, alphabet, max_length):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, max_length)))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_substring_search(seed):
+    rng = random.Random(seed)
+    # A small alphabet makes keywords overlap and share prefixes and suffixes
+    keywords = [(f"label{rng.randrange(8)}", random_word(rng, "abcAB ", 5)) for _ in range(60)]
+    matcher = KeywordMatcher(keywords)
+    for _ in range(300):
+        text = random_word(rng, "abcdAB ", 40)
+        assert matcher.match(text) == reference_match(keywords, text), text
+
+
+def test_keywords_inside_other_keywords():
+    keywords = [("outer", "ashes"), ("inner", "she"), ("short", "he"), ("other", "hers")]
+    matcher = KeywordMatcher(keywords)
+    assert matcher.match("ushers") == reference_match(keywords, "ushers") == ["inner", "short", "other"]
+    assert matcher.match("cashes") == ["outer", "inner", "short"]
+
+
+def test_case_insensitive_and_blank_keywords_ignored():
+    matcher = KeywordMatcher([("spam", " FREE Money "), ("blank", "  ")])
+    assert matcher.match("Get free money now") == ["spam"]
+    assert matcher.match(None) == []
+    assert matcher.labels == ["spam"]
+    assert len(matcher) == 1
+
+
+def test_load(tmp_path):
+    path = tmp_path / "keywords.csv"
+    path.write_text("label,keyword\nfantasy,dragon\nfantasy,wizard\nscience fiction,space\n")
+    matcher = KeywordMatcher.load(str(path))
+    assert matcher.match("A wizard in space") == ["fantasy", "science fiction"]
+    assert KeywordMatcher.from_mapping({"fantasy": ["dragon"]}).match("Dragons!") == ["fantasy"]
@@ -0,0 +1,99 @@
+"""KnownFraudIndex against a set of the normalized entries."""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../fraud_detection/src"))
+
+from known_fraud_index import KINDS, KnownFraudIndex, _hashes, card_fingerprint, normalize
+
+
+def random_value(rng, kind):
+    if kind == "user":
+        return rng.choice(["Anna", "John", "Mart"]) + " " + str(rng.randrange(10**6))
+    if kind == "contact":
+        return f"user{rng.randrange(10**6)}@example.com"
+    if kind == "address":
+        return f"{rng.randrange(1000)} {rng.choice(['Main', 'Oak', 'Pine'])} Street {rng.randrange(10**4)}"
+    return "".join(rng.choice("0123456789") for _ in range(16))
+
+
+def random_entries(rng, n):
+    entries = []
+    for _ in range(n):
+        kind = rng.choice(KINDS)
+        entries.append((kind, random_value(rng, kind)))
+    return entries
+
+
+@pytest.fixture(scope="module")
+def entries():
+    return random_entries(random.Random(19), 5000)
+
+
+@pytest.fixture(scope="module")
+def index(entries):
+    return KnownFraudIndex.from_entries(entries, fp_rate=0.01)
+
+
+def test_contains_every_entry(entries, index):
+    assert all(index.contains(kind, value) for kind, value in entries)
+
+
+def test_matches_a_set_of_normalized_values(entries, index):
+    reference = {(kind, normalize(kind, value)) for kind, value in entries}
+    rng = random.Random(20)
+    for kind, value in random_entries(rng, 20000):
+        assert index.contains(kind, value) == ((kind, normalize(kind, value)) in reference)
+
+
+def test_bloom_filter_false_positive_rate(index):
+    # Values never added, the sorted fingerprints reject what the Bloom filter lets through
+    probes = [_hashes("user", f"absent {i}") for i in range(20000)]
+    false_positives = sum(index._might_contain(first, second) for first, second in probes)
+    assert false_positives / len(probes) < 0.02
+
+
+def test_kinds_do_not_match_each_other():
+    index = KnownFraudIndex.from_entries([("user", "12345")])
+    assert index.contains("user", "12345")
+    assert not index.contains("contact", "12345")
+
+
+def test_values_are_normalized():
+    index = KnownFraudIndex.from_entries([
+        ("user", "  John   DOE "),
+        ("contact", "+372 5555-0100"),
+        ("contact", "Fraud@Example.com"),
+        ("address", "12 Main Street, Apt. 4"),
+        ("card", "4111 1111 1111 1111"),
+    ])
+    assert index.contains("user", "john doe")
+    assert index.contains("contact", "37255550100")
+    assert index.contains("contact", "fraud@example.COM")
+    assert index.contains("address", "12 main st apt 4")
+    assert index.contains("card", "4111111111111111")
+    assert index.counts == {"user": 1, "contact": 2, "address": 1, "card": 1}
+
+
+def test_cards_can_be_listed_by_fingerprint():
+    index = KnownFraudIndex.from_entries([("card", card_fingerprint("4000000000000002").upper())])
+    assert index.contains("card", "4000-0000-0000-0002")
+    assert not index.contains("card", "4111111111111111")
+
+
+def test_empty_index_and_values():
+    index = KnownFraudIndex.from_entries([("user", "   ")])
+    assert len(index) == 0
+    assert not index.contains("user", "")
+    assert not index.contains("user", "anyone")
+
+
+def test_load(tmp_path):
+    path = tmp_path / "known_fraud.csv"
+    path.write_text("kind,value\nuser,Kevin\nAddress,1 Fraud Road\n")
+    index = KnownFraudIndex.load(str(path))
+    assert index.contains("user", "KEVIN")
+    assert index.contains("address", "1 fraud rd")
@@ -0,0 +1,146 @@
+"""ShardedOrderStore against one insertion ordered dict per shard."""
+import math
+import os
+import random
+import sys
+import threading
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../utils"))
+
+from service_wrappers.order_state_store import OrderRecord, ShardedOrderStore
+
+
+class ReferenceStore:
+    """Same shards and eviction order as the store, without locks."""
+
+    def __init__(self, n_shards, max_entries):
+        self.n_shards = n_shards
+        self.capacity = math.ceil(max_entries / n_shards) if max_entries is not None else None
+        self.shards = [OrderedDict() for _ in range(n_shards)]
+
+    def _shard(self, order_id):
+        return self.shards[hash(order_id) % self.n_shards]
+
+    def _evict(self, shard):
+        evicted = []
+        while self.capacity is not None and len(shard) > self.capacity:
+            evicted.append(shard.popitem(last=False)[1])
+        return evicted
+
+    def put(self, record):
+        shard = self._shard(record.order_id)
+        shard.pop(record.order_id, None)
+        shard[record.order_id] = record
+        return self._evict(shard)
+
+    def put_if_absent(self, record):
+        shard = self._shard(record.order_id)
+        if record.order_id in shard:
+            return shard[record.order_id], []
+        shard[record.order_id] = record
+        return record, self._evict(shard)
+
+    def get(self, order_id):
+        return self._shard(order_id).get(order_id)
+
+    def pop(self, order_id):
+        return self._shard(order_id).pop(order_id, None)
+
+    def pop_created_before(self, timestamp):
+        expired = []
+        for shard in self.shards:
+            # Oldest first, a shard is only scanned up to its first record still alive
+            for order_id, record in list(shard.items()):
+                if record.created_at >= timestamp:
+                    break
+                expired.append(shard.pop(order_id))
+        return expired
+
+
+def new_record(order_id, created_at):
+    record = OrderRecord(order_id, order=None, n_services=3)
+    record.created_at = created_at
+    return record
+
+
+@pytest.mark.parametrize("n_shards,max_entries", [(1, None), (4, None), (1, 5), (4, 10), (16, 7)])
+def test_operations_match_the_reference(n_shards, max_entries):
+    rng = random.Random(8)
+    store = ShardedOrderStore(n_shards=n_shards, max_entries=max_entries)
+    reference = ReferenceStore(n_shards, max_entries)
+    now = 0.0
+    for _ in range(3000):
+        now += rng.random()
+        order_id = f"order-{rng.randrange(30)}"
+        operation = rng.choice(["put", "put_if_absent", "get", "pop", "pop_created_before"])
+        if operation == "put":
+            record = new_record(order_id, now)
+            assert store.put(record) == reference.put(record)
+        elif operation == "put_if_absent":
+            record = new_record(order_id, now)
+            assert store.put_if_absent(record) == reference.put_if_absent(record)
+        elif operation == "get":
+            assert store.get(order_id) is reference.get(order_id)
+            assert (order_id in store) == (reference.get(order_id) is not None)
+        elif operation == "pop":
+            assert store.pop(order_id) is reference.pop(order_id)
+        else:
+            assert store.pop_created_before(now - 10) == reference.pop_created_before(now - 10)
+        assert len(store) == sum(len(shard) for shard in reference.shards)
+
+
+def test_capacity_evicts_the_oldest_records_of_the_shard():
+    store = ShardedOrderStore(n_shards=1, max_entries=2)
+    first, second, third = (new_record(order_id, 0) for order_id in ("a", "b", "c"))
+    assert store.put(first) == []
+    assert store.put(second) == []
+    assert store.put(first) == []
+    assert store.put(third) == [second]
+    assert store.get("a") is first and store.get("c") is third
+    assert store.put_if_absent(new_record("d", 0))[1] == [first]
+
+
+def test_put_if_absent_stores_one_record_per_order():
+    store = ShardedOrderStore(n_shards=4)
+    n_threads = 16
+    barrier = threading.Barrier(n_threads)
+    results = [[] for _ in range(n_threads)]
+
+    def worker(index):
+        barrier.wait()
+        for i in range(200):
+            record = new_record(f"order-{i}", 0)
+            stored, _ = store.put_if_absent(record)
+            results[index].append((stored is record, stored))
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(store) == 200
+    for i in range(200):
+        outcomes = [thread_results[i] for thread_results in results]
+        # Exactly one thread stored its record, every other one got that same record back
+        assert sum(won for won, _ in outcomes) == 1
+        assert all(stored is store.get(f"order-{i}") for _, stored in outcomes)
+
+
+def test_pop_created_before():
+    store = ShardedOrderStore(n_shards=2)
+    records = [new_record(f"order-{i}", float(i)) for i in range(10)]
+    for record in records:
+        store.put(record)
+    assert sorted(record.created_at for record in store.pop_created_before(4.0)) == [0.0, 1.0, 2.0, 3.0]
+    assert len(store) == 6
+    assert store.pop_created_before(0.0) == []
+
+
+@pytest.mark.parametrize("n_shards,max_entries", [(0, None), (-1, None), (4, 0), (4, -5)])
+def test_invalid_sizes(n_shards, max_entries):
+    with pytest.raises(ValueError):
+        ShardedOrderStore(n_shards=n_shards, max_entries=max_entries)
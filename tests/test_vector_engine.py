@@ -0,0 +1,158 @@
+"""Sparse VectorRecommender against dense cosine similarity over the same hashed TF-IDF features."""
+import math
+import os
+import random
+import sys
+import zlib
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../recommendation_system/src"))
+
+from catalog_index import CatalogIndex
+from vector_engine import VectorRecommender, genre_terms, terms
+
+
+N_FEATURES = 2**10
+GENRE_WEIGHT = 2
+WORDS = ["dragon", "wizard", "space", "station", "murder", "detective", "love", "letters", "empire", "ocean",
+         "winter", "garden", "machine", "ghost", "river", "crown", "shadow", "forest", "signal", "harbor"]
+GENRES = ["Fantasy", "Science Fiction", "Mystery", "Romance", "History"]
+
+
+def random_text(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def random_catalog(rng, n):
+    return [
+        {
+            "bookId": str(i),
+            "title": random_text(rng, rng.randint(1, 3)).title(),
+            "author": rng.choice(["Ann Lee", "Mark Stone", "Ivy Hart"]),
+            "description": random_text(rng, rng.randint(0, 12)),
+            "genres": rng.sample(GENRES, rng.randint(0, 2)),
+        }
+        for i in range(n)
+    ]
+
+
+def feature_vector(term_list):
+    vector = np.zeros(N_FEATURES)
+    for term in term_list:
+        term_hash = zlib.crc32(term.encode("utf-8"))
+        vector[term_hash % N_FEATURES] += 1 if term_hash >> 31 else -1
+    return vector
+
+
+class DenseReference:
+    """Every book as a dense L2-normalized TF-IDF row, scored against the whole matrix."""
+
+    def __init__(self, books, max_postings=None):
+        self.books = books
+        counts = np.array([
+            feature_vector(terms(" ".join((book["title"], book["author"], book["description"])))
+                           + genre_terms(book["genres"]) * GENRE_WEIGHT)
+            for book in books
+        ])
+        document_frequency = (counts != 0).sum(axis=0)
+        self.idf = np.log((1 + len(books)) / (1 + document_frequency)) + 1
+        matrix = counts * self.idf
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        if max_postings is not None:
+            matrix[:, document_frequency > max_postings] = 0
+        self.matrix = matrix
+
+    def scores(self, cart_titles, comment, preferred_genres):
+        cart = {title.strip().lower() for title in cart_titles}
+        # Like the cart terms, the genres of a title count once per cart line
+        cart_genres = [
+            genre
+            for title in cart_titles
+            for book in self.books
+            if book["title"].lower() == title.strip().lower()
+            for genre in book["genres"]
+        ]
+        query = feature_vector(terms(" ".join([*cart_titles, comment]))
+                               + genre_terms([*preferred_genres, *cart_genres]) * GENRE_WEIGHT) * self.idf
+        norm = math.sqrt(query @ query)
+        scores = self.matrix @ (query / norm if norm else query)
+        for position, book in enumerate(self.books):
+            if book["title"].lower() in cart:
+                scores[position] = -np.inf
+        return scores
+
+
+def random_query(rng, books):
+    cart_titles = [book["title"] for book in rng.sample(books, rng.randint(0, 3))]
+    return cart_titles, random_text(rng, rng.randint(0, 4)), rng.sample(GENRES, rng.randint(0, 2))
+
+
+def assert_is_top_k(result, reference_scores, k):
+    positions = [int(book["bookId"]) for book, _ in result]
+    assert len(positions) == min(k, int(np.isfinite(reference_scores).sum()))
+    assert np.allclose([score for _, score in result], reference_scores[positions], atol=1e-5)
+    assert all(first >= second for (_, first), (_, second) in zip(result, result[1:]))
+    # Equal scores may come in any order, no book left out scores more than the ones returned
+    left_out = np.delete(reference_scores, positions)
+    if positions and len(left_out):
+        assert left_out.max() <= reference_scores[positions].min() + 1e-5
+
+
+@pytest.fixture(scope="module")
+def books():
+    return random_catalog(random.Random(24), 400)
+
+
+def test_scores_match_dense_cosine_similarity(books):
+    recommender = VectorRecommender(CatalogIndex(books), n_features=N_FEATURES, genre_weight=GENRE_WEIGHT)
+    reference = DenseReference(books)
+    rng = random.Random(25)
+    for _ in range(200):
+        cart_titles, comment, preferred_genres = random_query(rng, books)
+        scores = recommender.scores(*recommender.query_vector(cart_titles, comment, preferred_genres))
+        expected = np.nan_to_num(reference.scores(cart_titles, comment, preferred_genres), neginf=0)
+        cart = recommender.catalog.title_positions(cart_titles)
+        expected[list(cart)] = scores[list(cart)]
+        assert np.allclose(scores, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_top_k_is_exact_by_default(books, k):
+    recommender = VectorRecommender(CatalogIndex(books), n_features=N_FEATURES, genre_weight=GENRE_WEIGHT)
+    assert recommender.max_postings is None
+    reference = DenseReference(books)
+    rng = random.Random(26 + k)
+    for _ in range(100):
+        cart_titles, comment, preferred_genres = random_query(rng, books)
+        result = recommender.top_k(cart_titles, comment, preferred_genres, k)
+        assert_is_top_k(result, reference.scores(cart_titles, comment, preferred_genres), k)
+
+
+def test_max_postings_leaves_out_common_features(books):
+    rng = random.Random(27)
+    for max_postings in (len(books), 40):
+        recommender = VectorRecommender(
+            CatalogIndex(books), n_features=N_FEATURES, genre_weight=GENRE_WEIGHT, max_postings=max_postings
+        )
+        reference = DenseReference(books, max_postings=max_postings)
+        for _ in range(50):
+            cart_titles, comment, preferred_genres = random_query(rng, books)
+            result = recommender.top_k(cart_titles, comment, preferred_genres, 10)
+            positive = [(book, score) for book, score in result if score > 1e-5]
+            assert_is_top_k(positive, np.maximum(reference.scores(cart_titles, comment, preferred_genres), 0), len(positive))
+
+
+def test_cart_books_are_never_recommended(books):
+    recommender = VectorRecommender(CatalogIndex(books), n_features=N_FEATURES)
+    cart_titles = [books[0]["title"].upper(), books[1]["title"]]
+    result = recommender.top_k(cart_titles, "", [], len(books))
+    cart = {book["title"] for book in books[:2]}
+    assert all(book["title"] not in cart for book, _ in result)
+    assert len(result) == len(books) - len(recommender.catalog.title_positions(cart_titles))
+
+
+def test_empty_catalog_and_k():
+    assert VectorRecommender(CatalogIndex([])).top_k([], "dragons", [], 5) == []
+    assert VectorRecommender(CatalogIndex(random_catalog(random.Random(1), 10))).top_k([], "dragons", [], 0) == []
@@ -0,0 +1,89 @@
+"""Bucketed SlidingWindowCounter against the timestamps of every hit."""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../fraud_detection/src"))
+
+from velocity import SlidingWindowCounter, VelocityLimit
+
+
+class ReferenceCounter:
+    """Keeps every hit; counts the hits of the buckets the window covers, like the counter."""
+
+    def __init__(self, window_sec, n_buckets):
+        self.bucket_sec = window_sec / n_buckets
+        self.n_buckets = n_buckets
+        self.hits = {}
+
+    def _epoch(self, now):
+        return int(now / self.bucket_sec)
+
+    def hit(self, key, now):
+        self.hits.setdefault(key, []).append(now)
+        return self.count(key, now)
+
+    def count(self, key, now):
+        epoch = self._epoch(now)
+        return sum(1 for hit in self.hits.get(key, ()) if epoch - self.n_buckets < self._epoch(hit) <= epoch)
+
+    def exact_count(self, key, now, window_sec):
+        return sum(1 for hit in self.hits.get(key, ()) if now - window_sec < hit <= now)
+
+
+@pytest.mark.parametrize("window_sec,n_buckets", [(60, 12), (10, 1), (3600, 60), (1, 7)])
+def test_counts_match_the_hit_timestamps(window_sec, n_buckets):
+    rng = random.Random(21)
+    counter = SlidingWindowCounter(window_sec, n_buckets=n_buckets)
+    reference = ReferenceCounter(window_sec, n_buckets)
+    now = 1000.0
+    for _ in range(3000):
+        # Bursts, pauses within a window and gaps longer than the window
+        now += rng.choice([0.0, rng.random() * window_sec / 10, rng.random() * window_sec, window_sec * 3])
+        key = rng.choice("abc")
+        if rng.random() < 0.8:
+            assert counter.hit(key, now=now) == reference.hit(key, now)
+        else:
+            assert counter.count(key, now=now) == reference.count(key, now)
+
+
+def test_count_is_exact_to_one_bucket():
+    window_sec, n_buckets = 60, 12
+    rng = random.Random(22)
+    counter = SlidingWindowCounter(window_sec, n_buckets=n_buckets)
+    reference = ReferenceCounter(window_sec, n_buckets)
+    now = 0.0
+    for _ in range(2000):
+        now += rng.random() * 3
+        count = counter.hit("key", now=now)
+        reference.hit("key", now)
+        # The oldest bucket has partly slid out of the window and is not counted any more
+        assert reference.exact_count("key", now, window_sec - window_sec / n_buckets) <= count
+        assert count <= reference.exact_count("key", now, window_sec)
+
+
+def test_least_recently_hit_keys_are_dropped():
+    counter = SlidingWindowCounter(60, max_keys=3, n_shards=1)
+    for key in "abc":
+        counter.hit(key, now=0)
+    counter.hit("a", now=1)
+    counter.hit("d", now=2)
+    assert len(counter) == 3
+    assert counter.count("b", now=2) == 0
+    assert counter.count("a", now=2) == 2
+
+
+def test_invalid_windows():
+    with pytest.raises(ValueError):
+        SlidingWindowCounter(0)
+    with pytest.raises(ValueError):
+        SlidingWindowCounter(60, n_buckets=0)
+
+
+def test_parse_limits():
+    limits = VelocityLimit.parse("card:60:5, contact:3600:20,,", n_buckets=6)
+    assert [(limit.dimension, limit.window_sec, limit.max_orders) for limit in limits] == [("card", 60.0, 5), ("contact", 3600.0, 20)]
+    assert limits[0].counter.n_buckets == 6
+    assert [limits[0].hit("4111", now=10) for _ in range(3)] == [1, 2, 3]
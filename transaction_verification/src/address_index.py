@@ -0,0 +1,198 @@
+import csv
+import re
+import threading
+from concurrent import futures
+
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+# Outcomes of an offline lookup
+KNOWN = "known"
+MISMATCH = "mismatch"
+UNKNOWN = "unknown"
+
+
+def normalize(value):
+    value = _NON_WORD.sub(" ", (value or "").lower())
+    return _SPACES.sub(" ", value).strip()
+
+
+def normalize_zip(value):
+    return (value or "").replace(" ", "").replace("-", "").upper()
+
+
+class AddressIndex:
+    """
+    In-memory gazetteer of (country, state, city, zip) tuples.
+
+    Gazetteer rows are `country,state,city,zip`; a zip ending with `*` is a prefix
+    matching every zip of the city. Alias rows `kind,alias,canonical` map alternative
+    country and state spellings (kind is `country` or `state`) to the gazetteer ones.
+    """
+
+    def __init__(self):
+        self.country_aliases = dict()
+        self.state_aliases = dict()
+        self.places = set()
+        # (country, zip) -> states the zip belongs to, zips of covered countries only
+        self.zip_states = dict()
+        # (country, zip prefix) -> set of (state, city)
+        self.zip_prefixes = dict()
+        self.max_prefix_length = 0
+        self.countries = set()
+
+    @classmethod
+    def load(cls, gazetteer_path, aliases_path=None):
+        index = cls()
+        if aliases_path is not None:
+            with open(aliases_path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    index.add_alias(row["kind"], row["alias"], row["canonical"])
+        with open(gazetteer_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                index.add(row["country"], row["state"], row["city"], row["zip"])
+        return index
+
+    def add_alias(self, kind, alias, canonical):
+        aliases = self.country_aliases if kind == "country" else self.state_aliases
+        aliases[normalize(alias)] = normalize(canonical)
+
+    def _key(self, country, state, city):
+        country = normalize(country)
+        country = self.country_aliases.get(country, country)
+        state = normalize(state)
+        state = self.state_aliases.get(state, state)
+        return country, state, normalize(city)
+
+    def add(self, country, state, city, zip_code):
+        country, state, city = self._key(country, state, city)
+        self.countries.add(country)
+        if zip_code.endswith("*"):
+            prefix = normalize_zip(zip_code[:-1])
+            self.zip_prefixes.setdefault((country, prefix), set()).add((state, city))
+            self.max_prefix_length = max(self.max_prefix_length, len(prefix))
+        else:
+            zip_code = normalize_zip(zip_code)
+            self.places.add((country, state, city, zip_code))
+            self.zip_states.setdefault((country, zip_code), set()).add(state)
+
+    def lookup(self, country, state, city, zip_code):
+        country, state, city = self._key(country, state, city)
+        zip_code = normalize_zip(zip_code)
+
+        if (country, state, city, zip_code) in self.places:
+            return KNOWN
+        for length in range(min(len(zip_code), self.max_prefix_length), 0, -1):
+            if (state, city) in self.zip_prefixes.get((country, zip_code[:length]), ()):
+                return KNOWN
+
+        # A zip the gazetteer places in another state is wrong whatever the geocoder says
+        states = self.zip_states.get((country, zip_code))
+        if states is not None and state not in states:
+            return MISMATCH
+        return UNKNOWN
+
+    def __len__(self):
+        return len(self.places) + sum(len(places) for places in self.zip_prefixes.values())
+
+
+class AddressValidator:
+    """
+    Billing address validation: offline gazetteer first, then cached geocoding results,
+    then the online geocoder.
+
+    The geocoder is asked about the locality (city, state, zip, country) of addresses the
+    gazetteer does not know, not about the street: geocoders miss plenty of real streets,
+    but a locality they can not find at all does not exist.
+
+    geocoder_mode is `off`, `sync` or `async`. In `sync` mode the order waits for the
+    geocoder, or its cached answer, and is rejected when the locality is not found; a
+    failed lookup accepts it. In `async` mode the order never waits, so the verdict does
+    not depend on whether a background lookup finished: localities the gazetteer does not
+    know are always accepted, and the ones the geocoder can not find are only logged.
+    "Not found" answers are cached for `negative_ttl_sec` only, so a geocoder outage or a
+    newly mapped locality does not reject addresses for the whole cache TTL.
+    """
+
+    def __init__(
+        self, index, cache, geocoder_factory=None, geocoder_mode="async", geocoder_timeout=1, negative_ttl_sec=300, logger=None
+    ):
+        self.index = index
+        self.cache = cache
+        self.negative_ttl_sec = negative_ttl_sec
+        self.geocoder_factory = geocoder_factory
+        self.geocoder_mode = geocoder_mode if geocoder_factory is not None else "off"
+        self.geocoder_timeout = geocoder_timeout
+        self.logger = logger
+        self._geocoder = None
+        # Public geocoders allow about one request per second, one worker keeps to that
+        self._executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="geocoder")
+        self._pending_lock = threading.Lock()
+        self._pending = set()
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+
+    def _geocode(self, key, address):
+        if self._geocoder is None:
+            self._geocoder = self.geocoder_factory()
+        location = self._geocoder.geocode(address, timeout=self.geocoder_timeout)
+        resolved = location is not None
+        self.cache.put(key, resolved, ttl_sec=None if resolved else self.negative_ttl_sec)
+        if resolved:
+            self._log("info", f"Location is resolved: {location}")
+        return resolved
+
+    def _geocode_in_background(self, key, address):
+        try:
+            self._geocode(key, address)
+        except Exception as e:
+            self._log("warning", f"Background location resolution failed: {e}")
+        finally:
+            with self._pending_lock:
+                self._pending.discard(key)
+
+    def _resolve_online(self, key, address):
+        """True or False once the geocoder answered, None when the answer is not available."""
+        if self.geocoder_mode == "sync":
+            try:
+                return self._geocode(key, address)
+            except Exception as e:
+                self._log("warning", f"Location resolution failed: {e}")
+                return None
+
+        if self.geocoder_mode == "async":
+            with self._pending_lock:
+                if key in self._pending:
+                    return None
+                self._pending.add(key)
+            self._executor.submit(self._geocode_in_background, key, address)
+        return None
+
+    def validate(self, street, city, state, zip_code, country):
+        if not all(field.strip() for field in (street, city, state, zip_code, country)):
+            return False
+
+        match = self.index.lookup(country, state, city, zip_code)
+        if match == KNOWN:
+            return True
+        if match == MISMATCH:
+            self._log("warning", f"Zip {zip_code} does not belong to {state}, {country}")
+            return False
+
+        key = (normalize(city), normalize(state), normalize_zip(zip_code), normalize(country))
+        resolved = self.cache.get(key)
+        if resolved is None:
+            resolved = self._resolve_online(key, f"{city}, {state} {zip_code}, {country}")
+        if resolved is None:
+            self._log("info", "Locality is not resolved, accepting the complete address")
+            return True
+        if not resolved:
+            if self.geocoder_mode != "sync":
+                # Earlier orders from the locality were accepted before the answer arrived, so are the next ones
+                self._log("warning", f"Geocoder found no locality {city}, {state} {zip_code}, {country}, accepting in {self.geocoder_mode} mode")
+                return True
+            self._log("warning", f"Geocoder found no locality {city}, {state} {zip_code}, {country}")
+        return resolved
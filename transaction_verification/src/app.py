@@ -1,6 +1,6 @@
 import sys
 import os
-import threading
+import queue
 
 FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
 utils_path = os.path.abspath(os.path.join(FILE, '../../../utils/'))
@@ -26,21 +26,77 @@ from concurrent import futures
 import datetime
 from geopy.geocoders import Nominatim
 
+from address_index import AddressIndex, AddressValidator
+from batch_validation import validate_orders
+from bin_table import BinTable, MAX_CARD_LENGTH, MIN_CARD_LENGTH
+from other.lru_cache import LRUCache
+from other.reloadable import ReloadableFile
+
 
 logger = setup_logger("TransactionVerificationService")
 
+# Orders verified concurrently, each holds one thread of the gRPC server pool
+TRANSACTION_VERIFICATION_WORKERS = int(os.environ.get("TRANSACTION_VERIFICATION_WORKERS", "32"))
+FRAUD_DETECTION_TARGET = os.environ.get("FRAUD_DETECTION_GRPC_TARGET", "fraud_detection:50051")
+RECOMMENDATION_SYSTEM_TARGET = os.environ.get("RECOMMENDATION_GRPC_TARGET", "recommendation_system:50053")
+
+# Billing address validation: offline gazetteer, cached geocoding results, then the online geocoder
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(FILE)), "gazetteer.csv"))
+ADDRESS_ALIASES_PATH = os.environ.get("ADDRESS_ALIASES_PATH", os.path.join(os.path.dirname(os.path.abspath(FILE)), "address_aliases.csv"))
+GEOCODER_MODE = os.environ.get("GEOCODER_MODE", "async")
+GEOCODE_CACHE_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE", "10000"))
+GEOCODE_CACHE_TTL_SEC = int(os.environ.get("GEOCODE_CACHE_TTL_SEC", "86400"))
+# Localities the geocoder did not find are asked about again much sooner
+GEOCODE_NEGATIVE_TTL_SEC = int(os.environ.get("GEOCODE_NEGATIVE_TTL_SEC", "300"))
+
+# Card network ranges, reloaded without a restart when the file changes
+BIN_TABLE_PATH = os.environ.get("BIN_TABLE_PATH", os.path.join(os.path.dirname(os.path.abspath(FILE)), "bin_ranges.csv"))
+BIN_TABLE_RELOAD_INTERVAL_SEC = float(os.environ.get("BIN_TABLE_RELOAD_INTERVAL_SEC", "5"))
+ACCEPTED_CARD_NETWORKS = frozenset(
+    network.strip().lower() for network in os.environ.get("ACCEPTED_CARD_NETWORKS", "visa,mastercard").split(",") if network.strip()
+)
+
 
 from telemetry.telemetry import get_telemetry
 tracer, meter = get_telemetry("transaction_verification")
 
 
+def load_address_index():
+    try:
+        index = AddressIndex.load(GAZETTEER_PATH, ADDRESS_ALIASES_PATH)
+        logger.info(f"Loaded {len(index)} gazetteer places from {GAZETTEER_PATH}")
+        return index
+    except (OSError, KeyError) as e:
+        logger.warning(f"Failed to load gazetteer, every address goes to the geocoder: {e}")
+        return AddressIndex()
+
+
+card_ranges = ReloadableFile(
+    BIN_TABLE_PATH,
+    BinTable.load,
+    check_interval_sec=BIN_TABLE_RELOAD_INTERVAL_SEC,
+    default=BinTable(),
+    logger=logger,
+)
+
+
+address_validator = AddressValidator(
+    index=load_address_index(),
+    cache=LRUCache(GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL_SEC),
+    geocoder_factory=lambda: Nominatim(user_agent="transaction_verification"),
+    geocoder_mode=GEOCODER_MODE,
+    negative_ttl_sec=GEOCODE_NEGATIVE_TTL_SEC,
+    logger=logger,
+)
+
+
 def validate_credit_card(card_number):
     # credit card verification - Luhn's Algorithm
     # reference - https://dev.to/seraph776/validate-credit-card-numbers-using-python-37j9
 
     logger.info(f"Verification of credit card number {card_number}")
 
-    if len(card_number) != 16:
+    if not MIN_CARD_LENGTH <= len(card_number) <= MAX_CARD_LENGTH or not card_number.isdigit():
         return False
 
     card_number = [int(num) for num in card_number]
@@ -55,9 +111,10 @@ def validate_credit_card(card_number):
 
 def validate_credit_card_vendor(card_number):
     logger.info(f"Verification of credit card vendor {card_number}")
-    is_mastercard = card_number[0] == "5" and (card_number[1] == "1" or card_number[1] == "5")
-    is_visa = card_number[0] == "4"
-    return is_mastercard or is_visa
+    card_range = card_ranges.get().lookup(card_number)
+    if card_range is None:
+        return False
+    return card_range.network in ACCEPTED_CARD_NETWORKS and len(card_number) in card_range.lengths
 
 
 def validate_expiration_date(in_date):
@@ -108,27 +165,13 @@ def validate_cvv(cvv):
 def validate_location(location_obj):
     address = f"{location_obj.street} {location_obj.city} {location_obj.state} {location_obj.country}"
     logger.info(f"Verification of address {address}")
-
-    fallback_ok = all([
-        bool(getattr(location_obj, "street", "").strip()),
-        bool(getattr(location_obj, "city", "").strip()),
-        bool(getattr(location_obj, "state", "").strip()),
-        bool(getattr(location_obj, "zip", "").strip()),
-        bool(getattr(location_obj, "country", "").strip()),
-    ])
-
-    try:
-        geolocator = Nominatim(user_agent="transaction_verification")
-        location = geolocator.geocode(address, timeout=1)
-        if location is not None:
-            logger.info(f"Location is resolved: {location}")
-            return True
-        logger.warning("Location was not resolved by geocoder, applying fallback validation")
-    except Exception as e:
-        logger.warning(f"Location resolution failed, applying fallback validation: {e}")
-
-    # Fallback for offline/sandbox environments where external geocoding is unavailable.
-    return fallback_ok
+    return address_validator.validate(
+        location_obj.street,
+        location_obj.city,
+        location_obj.state,
+        location_obj.zip,
+        location_obj.country,
+    )
 
 
 def validate_order_list(orders):
@@ -146,204 +189,234 @@ def validate_order_list(orders):
     return True
 
 
+class VerificationStage:
+    """A local verification event and the fraud detection events sent alongside it."""
+
+    def __init__(self, event_name, checks, fraud_events):
+        self.event_name = event_name
+        self.checks = checks
+        self.fraud_events = fraud_events
+
+
+# Verification DAG: the checks only depend on the order. The fraud detection events are sent at
+# once and run concurrently in fraud detection; meanwhile the local events run in the handler
+# thread (CPU-bound checks of microseconds each, threads would only add overhead under the GIL).
+# The recommendation request depends on all of them and is sent once they passed.
+VERIFICATION_STAGES = [
+    VerificationStage(
+        "VerifyItems",
+        [(lambda data: validate_order_list(data.items), "Validation of order list")],
+        ["CheckKnownFraudUsers"],
+    ),
+    VerificationStage(
+        "VerifyCreditCard",
+        [
+            (lambda data: validate_credit_card(data.credit_card.number), "Validation of credit card number"),
+            (lambda data: validate_credit_card_vendor(data.credit_card.number), "Validation of credit card vendor"),
+            (lambda data: validate_expiration_date(data.credit_card.expiration_date), "Validation of expiration date"),
+            (lambda data: validate_cvv(data.credit_card.cvv), "Validation of CVV"),
+        ],
+        ["CheckKnownFraudLocations"],
+    ),
+    VerificationStage(
+        "VerifyBillingAddress",
+        [(lambda data: validate_location(data.billing_address), "Validation of billing address")],
+        ["CheckVelocity", "CheckGeneralFraud"],
+    ),
+]
+
+
+class FraudEvents:
+    """Fraud detection events of one order, sent at the same time and cancellable until they finish."""
+
+    def __init__(self, service, request, event_names, context=None):
+        self.service = service
+        self.request = request
+        self.event_names = event_names
+        self.context = context
+        self._calls = dict()
+        self._done = queue.SimpleQueue()
+
+    def start(self):
+        for method_name in self.event_names:
+            # Every event carries the order, whichever of them reaches fraud detection first initializes it
+            message = order_details.OperationalMessage()
+            message.CopyFrom(self.request)
+            pending_call = self.service._start_request_to_service(
+                stub_class=fraud_detection_grpc.FraudDetectionServiceStub,
+                connection_string=FRAUD_DETECTION_TARGET,
+                method_name=method_name,
+                message=message,
+                context=self.context
+            )
+            self._calls[method_name] = (message, pending_call)
+            pending_call.add_done_callback(lambda _, name=method_name: self._done.put(name))
+
+    def join(self):
+        """Response of the first event that failed, cancelling the others; None if every event passed."""
+        for _ in range(len(self._calls)):
+            method_name = self._done.get()
+            message, pending_call = self._calls[method_name]
+            response = self.service._finish_event(message, method_name, pending_call)
+            if response is None:
+                response = self.service._failed_response(self.request.order_id, f"{method_name} was cancelled")
+            if not response.status.success:
+                self.cancel()
+                return response
+        return None
+
+    def cancel(self):
+        for _, pending_call in self._calls.values():
+            pending_call.cancel()
+
+
 class TransactionVerificationService(BaseServiceWrapper, transaction_verification_grpc.TransactionVerificationService):
     def __init__(self, service_id, n_services):
         super().__init__(service_id, n_services)
         self.logger = logger
 
     def _do_verification(self, request, verify_function):
-        data = self.order_details.get(request.order_id, None)
+        record = self.orders.get(request.order_id)
 
-        if data is None:
+        if record is None:
             logger.error(f"Order id {request.order_id} is not found")
             return False, f"Order id {request.order_id} is not found"
 
         for fn, fname in verify_function:
-            result = fn(data)
+            result = fn(record.order)
             if not result:
                 return result, f"Verification failed for {fname}"
         return True, ""
 
-    def _send_request_to_service_treaded(self, request, stub_class, connection_string, method_name, result_container, index):
-        result_container[index] = self._send_request_to_service(
-                    stub_class=stub_class,
-                    connection_string=connection_string,
-                    method_name=method_name,
-                    message=request
-                )
+    def _failed_response(self, order_id, error_message):
+        result = order_details.OrderResponce()
+        result.status.success = False
+        result.status.order_id = order_id
+        result.status.vector_clock[:] = self._get_vector_clock(order_id)
+        result.status.error_message = error_message
+        return result
 
-    def VerifyItems(self, request, context):
+    def _finish_event(self, request, method_name, pending_call):
+        """Response of a downstream event, None if it was cancelled."""
         try:
-            logger.info(f"Verifying items for order id {request.order_id} with vector clock {self.vector_clocks[request.order_id]}")
-            self._update_vector_clock(request.order_id, request.vector_clock)
-
+            return self._finish_request_to_service(request, pending_call)
+        except grpc.FutureCancelledError:
+            return None
+        except grpc.RpcError as e:
+            logger.error(f"{method_name} failed for order id {request.order_id}: {e.code().name}")
+            if e.code() == grpc.StatusCode.DEADLINE_EXCEEDED:
+                return self._failed_response(request.order_id, f"{method_name} did not finish in time")
+            return self._failed_response(request.order_id, f"{method_name} failed: {e.details()}")
+
+    def _request_recommendations(self, request, context):
+        # Sent with the order in the fused flow, where recommendation system has not seen it yet
+        message = order_details.OperationalMessage()
+        message.CopyFrom(request)
+        pending_call = self._start_request_to_service(
+            stub_class=recommendation_system_grpc.RecommendationServiceStub,
+            connection_string=RECOMMENDATION_SYSTEM_TARGET,
+            method_name="GetRecommendations",
+            message=message,
+            context=context
+        )
+        return self._finish_event(message, "GetRecommendations", pending_call)
+
+    def _run_local_event(self, request, stage):
+        # Reported as is if the order is unknown and the clock update fails
+        status = order_details.StatusMessage(order_id=request.order_id)
+        try:
+            logger.info(f"{stage.event_name} for order id {request.order_id} with vector clock {self._get_vector_clock(request.order_id)}")
             status = order_details.StatusMessage(
                 success=True,
                 order_id=request.order_id,
-                vector_clock=self.vector_clocks[request.order_id]
+                vector_clock=self._update_vector_clock(request.order_id, request.vector_clock)
             )
-
-            # Event FraudDetectionService.CheckKnownFraudUsers
-            result_container = [None]
-            event1 = threading.Thread(target=self._send_request_to_service_treaded, kwargs={
-                "request": request,
-                "stub_class": fraud_detection_grpc.FraudDetectionServiceStub,
-                "connection_string": "fraud_detection:50051",
-                "method_name": "CheckKnownFraudUsers",
-                "result_container": result_container,
-                "index": 0
-            })
-
-            event1.start()
-        
-            with tracer.start_as_current_span("VerifyItems"):
-                # Event TransactionVerificationService.VerifyItems
-                res, err_message = self._do_verification(request, [(lambda data: validate_order_list(data.items), "Validation of order list")])
+            with tracer.start_as_current_span(stage.event_name):
+                res, err_message = self._do_verification(request, stage.checks)
             status.success = res
             status.error_message = err_message
-
-            with tracer.start_as_current_span("Wait CheckKnownFraudUsers"):
-                event1.join()
-
-            if status.success and result_container[0].status.success:
-                return self.VerifyCreditCard(request, context)
-            
-            if not status.success:
-                result = order_details.OrderResponce()
-                result.status.CopyFrom(status)
-                return result
-            else:
-                return result_container[0]
         except Exception as e:
-            logger.error(f"Failed to do items verification: {str(e)}")
+            logger.error(f"Failed to do {stage.event_name}: {str(e)}")
             status.success = False
-            status.error_message = f"Failed to do items verification: {str(e)}"
-
-            result = order_details.OrderResponce()
-            result.status.CopyFrom(status)
-            return result
-
+            status.error_message = f"Failed to do {stage.event_name}: {str(e)}"
+        return status
 
-    def VerifyCreditCard(self, request, context):
-        try:
-            logger.info(f"Verifying credit card for order id {request.order_id} with vector clock {self.vector_clocks[request.order_id]}")
-            self._update_vector_clock(request.order_id, request.vector_clock)
+    def _verify(self, request, context, stages):
+        fraud_events = FraudEvents(self, request, [name for stage in stages for name in stage.fraud_events], context)
+        fraud_events.start()
 
-            status = order_details.StatusMessage(
-                success=True,
-                order_id=request.order_id,
-                vector_clock=self.vector_clocks[request.order_id]
-            )
-
-            # Event FraudDetectionService.CheckKnownFraudLocations
-            result_container = [None]
-            event1 = threading.Thread(target=self._send_request_to_service_treaded, kwargs={
-                "request": request,
-                "stub_class": fraud_detection_grpc.FraudDetectionServiceStub,
-                "connection_string": "fraud_detection:50051",
-                "method_name": "CheckKnownFraudLocations",
-                "result_container": result_container,
-                "index": 0
-            })
-
-            event1.start()
-        
-            # Event TransactionVerificationService.VerifyCreditCard
-            with tracer.start_as_current_span("VerifyCreditCard"):
-                res, err_message = self._do_verification(request, [
-                    (lambda data: validate_credit_card(data.credit_card.number), "Validation of credit card number"),
-                    (lambda data: validate_credit_card_vendor(data.credit_card.number), "Validation of credit card vendor"),
-                    (lambda data: validate_expiration_date(data.credit_card.expiration_date), "Validation of expiration date"),
-                    (lambda data: validate_cvv(data.credit_card.cvv), "Validation of CVV")
-                ])
-            status.success = res
-            status.error_message = err_message
-
-
-            with tracer.start_as_current_span("Wait CheckKnownFraudLocations"):
-                event1.join()
-
-            if status.success and result_container[0].status.success:
-                return self.VerifyBillingAddress(request, context)
-            
+        for stage in stages:
+            status = self._run_local_event(request, stage)
             if not status.success:
+                # The order is rejected already, stop the fraud detection events in flight
+                fraud_events.cancel()
+                logger.info(f"{stage.event_name} failed for order id {request.order_id}, fraud detection events cancelled")
                 result = order_details.OrderResponce()
                 result.status.CopyFrom(status)
                 return result
-            else:
-                return result_container[0]
-        except Exception as e:
-            logger.error(f"Failed to do items verification: {str(e)}")
-            status.success = False
-            status.error_message = f"Failed to do items verification: {str(e)}"
-
-            result = order_details.OrderResponce()
-            result.status.CopyFrom(status)
-            return result
 
-    
-    def VerifyBillingAddress(self, request, context):
         try:
-            logger.info(f"Verifying billing address for order id {request.order_id} with vector clock {self.vector_clocks[request.order_id]}")
-            self._update_vector_clock(request.order_id, request.vector_clock)
-
-            status = order_details.StatusMessage(
-                success=True,
-                order_id=request.order_id,
-                vector_clock=self.vector_clocks[request.order_id]
-            )
-
-            # Event FraudDetectionService.CheckGeneralFraud
-            result_container = [None]
-            event1 = threading.Thread(target=self._send_request_to_service_treaded, kwargs={
-                "request": request,
-                "stub_class": fraud_detection_grpc.FraudDetectionServiceStub,
-                "connection_string": "fraud_detection:50051",
-                "method_name": "CheckGeneralFraud",
-                "result_container": result_container,
-                "index": 0
-            })
-
-            event1.start()
-        
-            # Event TransactionVerificationService.VerifyBillingAddress
-            with tracer.start_as_current_span("VerifyBillingAddress"):
-                res, err_message = self._do_verification(request, [(lambda data: validate_location(data.billing_address), "Validation of billing address")])
-            status.success = res
-            status.error_message = err_message
-
-
-            with tracer.start_as_current_span("Wait CheckGeneralFraud"):
-                event1.join()
+            with tracer.start_as_current_span("Wait fraud detection"):
+                fraud_result = fraud_events.join()
+            if fraud_result is not None:
+                return fraud_result
+            # Depends on every check, so recommendation system only sees orders that passed them all
+            with tracer.start_as_current_span("Request recommendations"):
+                recommendations = self._request_recommendations(request, context)
+        except Exception as e:
+            logger.error(f"Fraud detection events failed for order id {request.order_id}: {str(e)}")
+            return self._failed_response(request.order_id, f"Fraud detection events failed: {str(e)}")
+        if not recommendations.status.success:
+            return recommendations
+
+        result = order_details.OrderResponce()
+        result.status.success = True
+        result.status.order_id = request.order_id
+        # Report the clock merged with the downstream events, the orchestrator clears every service with it
+        result.status.vector_clock[:] = self._get_vector_clock(request.order_id)
+        result.recommended_books.extend(recommendations.recommended_books)
+        return result
+
+    def VerifyTransactions(self, request, context):
+        orders = list(request.orders)
+        logger.info(f"Verifying batch of {len(orders)} orders")
+        with tracer.start_as_current_span("VerifyTransactions"):
+            checks = validate_orders(orders, card_ranges.get(), ACCEPTED_CARD_NETWORKS)
+            checks.append(("Validation of billing address", [validate_location(order.billing_address) for order in orders]))
+
+        statuses = []
+        for i, order in enumerate(orders):
+            status = order_details.StatusMessage(success=True, order_id=order.order_id)
+            for fname, results in checks:
+                if not results[i]:
+                    status.success = False
+                    status.error_message = f"Verification failed for {fname}"
+                    break
+            statuses.append(status)
+        return order_details.StatusMessageBatch(statuses=statuses)
+
+    def InitAndVerify(self, request, context):
+        self.InitTransaction(request, context)
+        message = order_details.OperationalMessage(
+            order_id=request.order_id,
+            vector_clock=[0] * self.n_services
+        )
+        # Fraud detection (and recommendation system after it) receive the order with their first event
+        message.order.CopyFrom(request)
+        return self.VerifyItems(message, context)
 
-            if status.success and result_container[0].status.success:
-                result = order_details.OrderResponce()
-                result.status.CopyFrom(status)
-                for i in range(len(result_container)):
-                    if len(result_container[i].recommended_books):
-                        result.recommended_books.extend(result_container[i].recommended_books)
-                        break
-                return result
+    def VerifyItems(self, request, context):
+        return self._verify(request, context, VERIFICATION_STAGES)
 
-            if not status.success:
-                result = order_details.OrderResponce()
-                result.status.CopyFrom(status)
-                return result
-            else:
-                return result_container[0]
-        except Exception as e:
-            logger.error(f"Failed to do items verification: {str(e)}")
-            status.success = False
-            status.error_message = f"Failed to do items verification: {str(e)}"
+    def VerifyCreditCard(self, request, context):
+        return self._verify(request, context, VERIFICATION_STAGES[1:])
 
-            result = order_details.OrderResponce()
-            result.status.CopyFrom(status)
-            return result
+    def VerifyBillingAddress(self, request, context):
+        return self._verify(request, context, VERIFICATION_STAGES[2:])
 
 
-    
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor())
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=TRANSACTION_VERIFICATION_WORKERS))
     transaction_verification_grpc.add_TransactionVerificationServiceServicer_to_server(TransactionVerificationService(0, 3), server)
     port = "50052"
     server.add_insecure_port("[::]:" + port)
@@ -0,0 +1,148 @@
+import datetime
+import weakref
+
+import numpy as np
+
+from bin_table import KEY_DIGITS, MAX_CARD_LENGTH, MIN_CARD_LENGTH
+
+
+# Cards can not be valid for more than 3 years
+MAX_CARD_VALIDITY_DAYS = 365 * 3
+MAX_ITEM_QUANTITY = 100
+
+
+def _digit_matrix(numbers, width, right_align=False):
+    """(n, width) matrix of digit values, rows padded with zeros or cut to `width`; non-digits are out of 0..9."""
+    if right_align:
+        joined = "".join(number[-width:].rjust(width, "0") for number in numbers)
+    else:
+        joined = "".join(number[:width].ljust(width, "0") for number in numbers)
+    raw = np.frombuffer(joined.encode("ascii", errors="replace"), dtype=np.uint8)
+    return raw.reshape(len(numbers), width).astype(np.int16) - ord("0")
+
+
+def _is_digit(digits):
+    return ((digits >= 0) & (digits <= 9)).all(axis=1)
+
+
+def _lengths(values):
+    return np.fromiter((len(value) for value in values), dtype=np.int64, count=len(values))
+
+
+def validate_card_numbers(numbers):
+    """Luhn check of 12 to 19 digit card numbers, same rules as validate_credit_card."""
+    if not numbers:
+        return np.zeros(0, dtype=bool)
+    # Right aligned, leading zeros do not change the Luhn sum
+    digits = _digit_matrix(numbers, MAX_CARD_LENGTH, right_align=True)
+    lengths = _lengths(numbers)
+    well_formed = (lengths >= MIN_CARD_LENGTH) & (lengths <= MAX_CARD_LENGTH) & _is_digit(digits)
+
+    # Every second digit from the right, check digit excluded, is doubled
+    doubled = digits[:, MAX_CARD_LENGTH % 2::2] * 2
+    doubled -= 9 * (doubled > 9)
+    check_sum = doubled.sum(axis=1) + digits[:, 1 - MAX_CARD_LENGTH % 2::2].sum(axis=1)
+    return well_formed & (check_sum % 10 == 0)
+
+
+# BinTable -> (starts, ends) arrays, built once per loaded table
+_table_arrays = weakref.WeakKeyDictionary()
+
+
+def _bin_table_arrays(table):
+    arrays = _table_arrays.get(table)
+    if arrays is None:
+        arrays = (np.array(table.starts, dtype=np.int64), np.array(table.ends, dtype=np.int64))
+        _table_arrays[table] = arrays
+    return arrays
+
+
+def validate_card_vendors(numbers, table, accepted_networks):
+    """Card range lookup of every number, same rules as validate_credit_card_vendor."""
+    if not numbers or not len(table):
+        return np.zeros(len(numbers), dtype=bool)
+    starts, ends = _bin_table_arrays(table)
+
+    prefix = _digit_matrix(numbers, KEY_DIGITS)
+    lengths = _lengths(numbers)
+    well_formed = (lengths >= KEY_DIGITS) & _is_digit(prefix)
+    keys = (np.where(well_formed[:, None], prefix, 0).astype(np.int64) * 10 ** np.arange(KEY_DIGITS - 1, -1, -1)).sum(axis=1)
+
+    index = np.searchsorted(starts, keys, side="right") - 1
+    covered = well_formed & (index >= 0) & (keys <= ends[np.maximum(index, 0)])
+
+    # Network and length rules only for the few distinct ranges the batch hit
+    valid = np.zeros(len(numbers), dtype=bool)
+    for entry_index in np.unique(index[covered]):
+        entry = table.entries[entry_index]
+        if entry.network not in accepted_networks:
+            continue
+        hits = covered & (index == entry_index)
+        valid |= hits & np.isin(lengths, list(entry.lengths))
+    return valid
+
+
+def _parse_expiration_date(in_date):
+    """(year, month) of a MM/YY or MM/YYYY date, None if it is malformed."""
+    parts = in_date.split("/")
+    if len(parts) < 2:
+        return None
+    month, year = parts[0].strip(), parts[1].strip()
+    if len(month) == 1:
+        month = f"0{month}"
+    if len(year) == 2:
+        year = f"20{year}"
+    if len(month) != 2 or len(year) != 4 or not month.isdigit() or not year.isdigit():
+        return None
+    return int(year), int(month)
+
+
+def validate_expiration_dates(dates, today=None):
+    """Same rules as validate_expiration_date, against one `today` for the whole batch."""
+    today = np.datetime64(today or datetime.date.today(), "D")
+    parsed = [_parse_expiration_date(in_date) for in_date in dates]
+    years = np.array([p[0] if p else 1970 for p in parsed], dtype=np.int64)
+    months = np.array([p[1] if p else 1 for p in parsed], dtype=np.int64)
+    well_formed = np.array([p is not None for p in parsed], dtype=bool) & (months >= 1) & (months <= 12)
+
+    # The card is valid through the last day of its expiration month
+    months_since_epoch = (years - 1970) * 12 + np.clip(months, 1, 12) - 1
+    valid_until = (months_since_epoch + 1).astype("datetime64[M]").astype("datetime64[D]")
+    days_left = (valid_until - today).astype(np.int64)
+    return well_formed & (days_left > 0) & (days_left <= MAX_CARD_VALIDITY_DAYS)
+
+
+def validate_cvvs(cvvs):
+    if not cvvs:
+        return np.zeros(0, dtype=bool)
+    cvvs = np.array(cvvs, dtype=str)
+    return (np.char.str_len(cvvs) == 3) & np.char.isdigit(cvvs)
+
+
+def validate_order_lists(orders_items):
+    """Same rules as validate_order_list for every order, `orders_items` holds the item lists."""
+    n_orders = len(orders_items)
+    counts = np.fromiter((len(items) for items in orders_items), dtype=np.int64, count=n_orders)
+    owners = np.repeat(np.arange(n_orders), counts)
+    quantities = np.fromiter((item.quantity for items in orders_items for item in items), dtype=np.int64, count=int(counts.sum()))
+    name_lengths = np.fromiter((len(item.name) for items in orders_items for item in items), dtype=np.int64, count=int(counts.sum()))
+
+    invalid_items = (quantities < 0) | (quantities > MAX_ITEM_QUANTITY) | (name_lengths == 0)
+    has_invalid_item = np.bincount(owners, weights=invalid_items, minlength=n_orders) > 0
+    return (counts > 0) & ~has_invalid_item
+
+
+def validate_orders(orders, table, accepted_networks, today=None):
+    """
+    Local checks of a batch of InputOrderDetails, in the order of the event chain.
+
+    Returns a list of (check name, boolean array) with one entry per order in every array.
+    """
+    numbers = [order.credit_card.number for order in orders]
+    return [
+        ("Validation of order list", validate_order_lists([order.items for order in orders])),
+        ("Validation of credit card number", validate_card_numbers(numbers)),
+        ("Validation of credit card vendor", validate_card_vendors(numbers, table, accepted_networks)),
+        ("Validation of expiration date", validate_expiration_dates([order.credit_card.expiration_date for order in orders], today)),
+        ("Validation of CVV", validate_cvvs([order.credit_card.cvv for order in orders])),
+    ]
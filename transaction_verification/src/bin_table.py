@@ -0,0 +1,102 @@
+import bisect
+import csv
+import heapq
+
+
+# Ranges are compared on the first KEY_DIGITS digits of the card number (8 digit BINs)
+KEY_DIGITS = 8
+MIN_CARD_LENGTH = 12
+MAX_CARD_LENGTH = 19
+
+
+class BinRange:
+    __slots__ = ("network", "lengths")
+
+    def __init__(self, network, lengths):
+        self.network = network
+        self.lengths = lengths
+
+
+def _range_key(prefix, fill):
+    return int(prefix[:KEY_DIGITS].ljust(KEY_DIGITS, fill))
+
+
+def _parse_lengths(value):
+    """`16`, `13|16|19` or `16-19`."""
+    lengths = set()
+    for part in value.split("|"):
+        if "-" in part:
+            low, high = part.split("-", 1)
+            lengths.update(range(int(low), int(high) + 1))
+        else:
+            lengths.add(int(part))
+    return frozenset(lengths)
+
+
+class BinTable:
+    """
+    IIN/BIN ranges compiled into sorted, non-overlapping intervals over 8 digit keys.
+
+    Rows are `network,prefix_start,prefix_end,lengths`, for example `mastercard,2221,2720,16`.
+    Where ranges overlap the narrowest one wins, so single BINs can override a network range.
+    Lookups are a binary search over the interval starts.
+    """
+
+    def __init__(self, ranges=()):
+        # (start, end, BinRange) with start/end inclusive KEY_DIGITS keys
+        self.starts = []
+        self.ends = []
+        self.entries = []
+        self._compile(list(ranges))
+
+    @classmethod
+    def load(cls, path):
+        ranges = []
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                start, end = row["prefix_start"].strip(), row["prefix_end"].strip()
+                if not start.isdigit() or not end.isdigit():
+                    raise ValueError(f"Invalid BIN range {start}-{end}")
+                low, high = _range_key(start, "0"), _range_key(end, "9")
+                if low > high:
+                    raise ValueError(f"Invalid BIN range {start}-{end}")
+                entry = BinRange(row["network"].strip().lower(), _parse_lengths(row["lengths"]))
+                ranges.append((low, high, entry))
+        return cls(ranges)
+
+    def _compile(self, ranges):
+        # Sweep over the range boundaries keeping the narrowest range covering each segment
+        boundaries = sorted({low for low, _, _ in ranges} | {high + 1 for _, high, _ in ranges})
+        ranges.sort(key=lambda r: r[0])
+        active = []
+        next_range = 0
+        for i in range(len(boundaries) - 1):
+            segment_start, segment_end = boundaries[i], boundaries[i + 1] - 1
+            while next_range < len(ranges) and ranges[next_range][0] <= segment_start:
+                low, high, entry = ranges[next_range]
+                heapq.heappush(active, (high - low, next_range, high, entry))
+                next_range += 1
+            while active and active[0][2] < segment_start:
+                heapq.heappop(active)
+            if not active:
+                continue
+            entry = active[0][3]
+            if self.entries and self.entries[-1] is entry and self.ends[-1] + 1 == segment_start:
+                self.ends[-1] = segment_end
+            else:
+                self.starts.append(segment_start)
+                self.ends.append(segment_end)
+                self.entries.append(entry)
+
+    def lookup(self, card_number):
+        """BinRange of a card number, None if no range covers it or it is malformed."""
+        if len(card_number) < KEY_DIGITS or not card_number[:KEY_DIGITS].isdigit():
+            return None
+        key = int(card_number[:KEY_DIGITS])
+        index = bisect.bisect_right(self.starts, key) - 1
+        if index < 0 or key > self.ends[index]:
+            return None
+        return self.entries[index]
+
+    def __len__(self):
+        return len(self.starts)
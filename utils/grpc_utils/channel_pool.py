@@ -0,0 +1,216 @@
+import asyncio
+import itertools
+import os
+import threading
+import weakref
+
+import grpc
+
+
+GRPC_CHANNEL_POOL_SIZE = int(os.environ.get("GRPC_CHANNEL_POOL_SIZE", "2"))
+GRPC_KEEPALIVE_TIME_MS = int(os.environ.get("GRPC_KEEPALIVE_TIME_MS", "30000"))
+GRPC_KEEPALIVE_TIMEOUT_MS = int(os.environ.get("GRPC_KEEPALIVE_TIMEOUT_MS", "10000"))
+GRPC_MAX_RECONNECT_BACKOFF_MS = int(os.environ.get("GRPC_MAX_RECONNECT_BACKOFF_MS", "2000"))
+
+# States after which a pooled channel is replaced instead of reused.
+_BROKEN_STATES = {
+    grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+    grpc.ChannelConnectivity.SHUTDOWN,
+}
+
+
+def channel_options(
+    keepalive_time_ms=GRPC_KEEPALIVE_TIME_MS,
+    keepalive_timeout_ms=GRPC_KEEPALIVE_TIMEOUT_MS,
+    max_reconnect_backoff_ms=GRPC_MAX_RECONNECT_BACKOFF_MS,
+):
+    return [
+        ("grpc.keepalive_time_ms", keepalive_time_ms),
+        ("grpc.keepalive_timeout_ms", keepalive_timeout_ms),
+        # Pings only while calls are active, otherwise servers answer with GOAWAY(too_many_pings).
+        ("grpc.keepalive_permit_without_calls", 0),
+        ("grpc.http2.max_pings_without_data", 0),
+        ("grpc.initial_reconnect_backoff_ms", min(100, max_reconnect_backoff_ms)),
+        ("grpc.max_reconnect_backoff_ms", max_reconnect_backoff_ms),
+    ]
+
+
+class _AioTargetPool:
+    """Fixed number of long-lived aio channels to one target, handed out round-robin."""
+
+    def __init__(self, target, size, options):
+        self.target = target
+        self.size = size
+        self.options = options
+        self._channels = [None] * size
+        self._stubs = [dict() for _ in range(size)]
+        self._next_index = itertools.count()
+
+    def _replace(self, index):
+        old_channel = self._channels[index]
+        channel = grpc.aio.insecure_channel(self.target, options=self.options)
+        self._channels[index] = channel
+        self._stubs[index] = {}
+        if old_channel is not None:
+            # Let calls that are still running on the old channel finish.
+            asyncio.ensure_future(old_channel.close(grace=5))
+        return channel
+
+    def acquire(self, stub_class):
+        index = next(self._next_index) % self.size
+        channel = self._channels[index]
+        if channel is None or channel.get_state(try_to_connect=False) in _BROKEN_STATES:
+            channel = self._replace(index)
+
+        stub = self._stubs[index].get(stub_class)
+        if stub is None:
+            stub = stub_class(channel)
+            self._stubs[index][stub_class] = stub
+        return stub, channel
+
+    def invalidate(self, channel):
+        for index, pooled in enumerate(self._channels):
+            if pooled is channel:
+                self._replace(index)
+                return
+
+    async def close(self):
+        channels = [channel for channel in self._channels if channel is not None]
+        self._channels = [None] * self.size
+        self._stubs = [dict() for _ in range(self.size)]
+        await asyncio.gather(*(channel.close() for channel in channels), return_exceptions=True)
+
+
+class AioChannelRegistry:
+    """
+    Process-wide registry of pooled grpc.aio channels and stubs, keyed by target.
+
+    aio channels are bound to the event loop that created them, so pools are kept per loop.
+    """
+
+    def __init__(self, pool_size=GRPC_CHANNEL_POOL_SIZE, options=None):
+        if pool_size <= 0:
+            raise ValueError("pool_size must be positive")
+        self.pool_size = pool_size
+        self.options = options if options is not None else channel_options()
+        self._lock = threading.Lock()
+        self._pools = weakref.WeakKeyDictionary()
+
+    def _target_pool(self, target):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_pools = self._pools.get(loop)
+            if loop_pools is None:
+                loop_pools = dict()
+                self._pools[loop] = loop_pools
+            pool = loop_pools.get(target)
+            if pool is None:
+                pool = _AioTargetPool(target, self.pool_size, self.options)
+                loop_pools[target] = pool
+        return pool
+
+    def stub(self, target, stub_class):
+        stub, _ = self._target_pool(target).acquire(stub_class)
+        return stub
+
+    async def call(self, target, stub_class, method_name, request, **kwargs):
+        pool = self._target_pool(target)
+        stub, channel = pool.acquire(stub_class)
+        try:
+            return await getattr(stub, method_name)(request, **kwargs)
+        except grpc.aio.AioRpcError as e:
+            if e.code() == grpc.StatusCode.UNAVAILABLE:
+                pool.invalidate(channel)
+            raise
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_pools = self._pools.pop(loop, {})
+        await asyncio.gather(*(pool.close() for pool in loop_pools.values()))
+
+
+class PendingCall:
+    """Call started with SyncChannelRegistry.start, can be cancelled until it completes."""
+
+    def __init__(self, registry, target, channel, call_future):
+        self._registry = registry
+        self._target = target
+        self._channel = channel
+        self._future = call_future
+
+    def cancel(self):
+        return self._future.cancel()
+
+    def add_done_callback(self, fn):
+        """Calls fn(self) once the call completed, failed or was cancelled."""
+        self._future.add_done_callback(lambda _: fn(self))
+
+    def result(self):
+        """Response of the call, raises grpc.RpcError on failure and grpc.FutureCancelledError if cancelled."""
+        try:
+            return self._future.result()
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.UNAVAILABLE:
+                self._registry.invalidate(self._target, self._channel)
+            raise
+
+
+class SyncChannelRegistry:
+    """
+    Process-wide cache of long-lived synchronous channels and stubs, one channel per target.
+
+    Sync channels are thread-safe and multiplex concurrent calls, so handler threads share them.
+    Channels connect lazily on the first call and are replaced after UNAVAILABLE; the
+    replaced channel is closed `close_grace_sec` later, so calls sharing it are not cancelled.
+    """
+
+    def __init__(self, options=None, close_grace_sec=5.0):
+        self.options = options if options is not None else channel_options()
+        self.close_grace_sec = close_grace_sec
+        self._lock = threading.Lock()
+        self._channels = dict()
+        self._stubs = dict()
+
+    def _acquire(self, target, stub_class):
+        with self._lock:
+            channel = self._channels.get(target)
+            if channel is None:
+                channel = grpc.insecure_channel(target, options=self.options)
+                self._channels[target] = channel
+            stub = self._stubs.get((target, stub_class))
+            if stub is None:
+                stub = stub_class(channel)
+                self._stubs[(target, stub_class)] = stub
+        return stub, channel
+
+    def stub(self, target, stub_class):
+        stub, _ = self._acquire(target, stub_class)
+        return stub
+
+    def invalidate(self, target, channel):
+        with self._lock:
+            if self._channels.get(target) is not channel:
+                return
+            del self._channels[target]
+            self._stubs = {key: stub for key, stub in self._stubs.items() if key[0] != target}
+        # New calls go to a fresh channel; the old one is closed once the calls it still carries
+        # had time to finish, like the aio pool's close(grace=5)
+        closer = threading.Timer(self.close_grace_sec, channel.close)
+        closer.daemon = True
+        closer.start()
+
+    def start(self, target, stub_class, method_name, request, **kwargs):
+        stub, channel = self._acquire(target, stub_class)
+        return PendingCall(self, target, channel, getattr(stub, method_name).future(request, **kwargs))
+
+    def call(self, target, stub_class, method_name, request, **kwargs):
+        return self.start(target, stub_class, method_name, request, **kwargs).result()
+
+    def close(self):
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels = {}
+            self._stubs = {}
+        for channel in channels:
+            channel.close()
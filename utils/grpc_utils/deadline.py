@@ -0,0 +1,46 @@
+import time
+
+
+# Absolute checkout deadline as unix time in milliseconds, set by the orchestrator
+# and forwarded by every hop of the validation chain.
+DEADLINE_METADATA_KEY = "x-checkout-deadline-ms"
+
+
+def deadline_metadata(deadline):
+    return ((DEADLINE_METADATA_KEY, str(int(deadline * 1000))),)
+
+
+def remaining_budget(context):
+    """Seconds left to serve the request, None when the caller did not set a deadline."""
+    if context is None:
+        return None
+
+    budgets = []
+    time_remaining = context.time_remaining()
+    if time_remaining is not None:
+        budgets.append(time_remaining)
+
+    for key, value in context.invocation_metadata() or ():
+        if key == DEADLINE_METADATA_KEY:
+            try:
+                budgets.append(int(value) / 1000 - time.time())
+            except ValueError:
+                pass
+
+    return min(budgets) if budgets else None
+
+
+def deadline_call_options(deadline):
+    """timeout and metadata keyword arguments for a call that has to finish by `deadline` (unix time)."""
+    return {
+        "timeout": max(deadline - time.time(), 0.0),
+        "metadata": deadline_metadata(deadline),
+    }
+
+
+def outgoing_call_options(context):
+    """timeout and metadata keyword arguments for a call made while serving `context`."""
+    budget = remaining_budget(context)
+    if budget is None:
+        return {}
+    return deadline_call_options(time.time() + budget)
@@ -0,0 +1,53 @@
+import asyncio
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+
+class AsyncLlmClient:
+    """
+    AsyncOpenAI client for services running on grpc.aio.
+
+    Calls share one pooled HTTP client, and at most `max_concurrency` of them reach the
+    LLM at once; the others wait on the semaphore as coroutines, not threads.
+    The client and semaphore bind to the event loop of the first call.
+    """
+
+    def __init__(self, api_key, model, max_concurrency=64, max_connections=None):
+        self.api_key = api_key
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections or max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                )),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def response_text(self, prompt, temperature=0, max_output_tokens=200, timeout=None):
+        """Text output of the Responses API for one user prompt, `timeout` includes the wait for a slot."""
+        client = self._get_client()
+        options = {} if timeout is None else {"timeout": timeout}
+        async with asyncio.timeout(timeout):
+            async with self._semaphore:
+                response = await client.responses.create(
+                    model=self.model,
+                    input=[{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    max_output_tokens=max_output_tokens,
+                    **options,
+                )
+        return (response.output_text or "").strip()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
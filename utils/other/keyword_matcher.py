@@ -0,0 +1,86 @@
+import csv
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over labelled keywords, case-insensitive substring matching.
+
+    A scan walks the text once whatever the number of keywords, so lists can grow to
+    thousands of entries. Keywords files are CSV with a `label,keyword` header.
+    """
+
+    def __init__(self, keywords):
+        """`keywords` is an iterable of (label, keyword) pairs."""
+        # Node 0 is the root, every node has its transitions, failure link and the labels ending there
+        self._transitions = [dict()]
+        self._fail = [0]
+        self._outputs = [set()]
+        # Labels in the order they were first given, results are reported in this order
+        self.labels = []
+        self._label_rank = dict()
+        self._n_keywords = 0
+
+        for label, keyword in keywords:
+            keyword = keyword.strip().lower()
+            if not keyword:
+                continue
+            if label not in self._label_rank:
+                self._label_rank[label] = len(self.labels)
+                self.labels.append(label)
+            self._add(keyword, label)
+        self._build_failure_links()
+
+    @classmethod
+    def from_mapping(cls, keywords_by_label):
+        return cls((label, keyword) for label, keywords in keywords_by_label.items() for keyword in keywords)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls((row["label"].strip(), row["keyword"]) for row in csv.DictReader(f))
+
+    def _add(self, keyword, label):
+        node = 0
+        for char in keyword:
+            next_node = self._transitions[node].get(char)
+            if next_node is None:
+                next_node = len(self._transitions)
+                self._transitions.append(dict())
+                self._fail.append(0)
+                self._outputs.append(set())
+                self._transitions[node][char] = next_node
+            node = next_node
+        self._outputs[node].add(label)
+        self._n_keywords += 1
+
+    def _build_failure_links(self):
+        pending = deque(self._transitions[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self._transitions[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._transitions[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._transitions[fail].get(char, 0)
+                # A node also matches everything its longest proper suffix matches
+                self._outputs[child] |= self._outputs[self._fail[child]]
+                pending.append(child)
+
+    def match(self, text):
+        """Labels with at least one keyword in `text`, in the order the labels were given."""
+        found = set()
+        node = 0
+        transitions, fail, outputs = self._transitions, self._fail, self._outputs
+        for char in (text or "").lower():
+            while node and char not in transitions[node]:
+                node = fail[node]
+            node = transitions[node].get(char, 0)
+            if outputs[node]:
+                found |= outputs[node]
+                if len(found) == len(self.labels):
+                    break
+        return sorted(found, key=self._label_rank.__getitem__)
+
+    def __len__(self):
+        return self._n_keywords
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+
+
+class ReloadableFile:
+    """
+    Value compiled from a data file, recompiled when the file changes.
+
+    `get()` checks the file modification time at most every `check_interval_sec` and
+    swaps in the newly compiled value as a whole, so readers always see either the old
+    or the new version. Only the reader that finds the check due reloads, the readers
+    arriving meanwhile get the current value instead of waiting for it. A file that fails
+    to load keeps the previous value, or `default` if it never loaded.
+
+    With `background=True` a daemon thread polls the file instead, so `get()` never waits
+    for a reload; meant for files that take long to compile.
+    """
+
+    def __init__(self, path, loader, check_interval_sec=5.0, default=None, logger=None, background=False):
+        self.path = path
+        self.loader = loader
+        self.check_interval_sec = check_interval_sec
+        self.logger = logger
+        self._reload_lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._value = default
+        self.background = background
+        self.reload()
+        if background:
+            threading.Thread(target=self._watch, name=f"reload-{os.path.basename(path)}", daemon=True).start()
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+        else:
+            print(message)
+
+    def reload(self):
+        """Recompiles the file if it changed since the last load, returns True if the value was swapped."""
+        with self._reload_lock:
+            return self._reload_locked()
+
+    def _reload_locked(self):
+        self._next_check = time.monotonic() + self.check_interval_sec
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            self._log("warning", f"Can not stat {self.path}: {e}")
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            value = self.loader(self.path)
+        except Exception as e:
+            # Not retried until the file changes again
+            self._mtime = mtime
+            self._log("error", f"Failed to load {self.path}, keeping the previous version: {e}")
+            return False
+        self._value = value
+        self._mtime = mtime
+        self._log("info", f"Loaded {self.path}")
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval_sec)
+            try:
+                self.reload()
+            except Exception as e:
+                self._log("error", f"Reload of {self.path} failed: {e}")
+
+    def get(self):
+        if not self.background and time.monotonic() >= self._next_check and self._reload_lock.acquire(blocking=False):
+            try:
+                self._reload_locked()
+            finally:
+                self._reload_lock.release()
+        return self._value
@@ -1,6 +1,7 @@
 import sys
 import os
 import threading
+import time
 
 def init_grpc_pathes():
     FILE = __file__ if '__file__' in globals() else os.getenv("PYTHONFILE", "")
@@ -20,53 +21,132 @@ init_grpc_pathes()
 # import pb.order_details.order_details_pb2 as order_details
 import pb.services.order_details_pb2 as order_details
 import grpc
+from opentelemetry import metrics
+
+from grpc_utils.channel_pool import SyncChannelRegistry
+from grpc_utils.deadline import outgoing_call_options
+from service_wrappers.order_state_store import OrderRecord, ShardedOrderStore
+
+
+# Safety net for orders whose ClearTransaction never arrives (orchestrator crash, failed clear).
+ORDER_STATE_TTL_SEC = float(os.environ.get("ORDER_STATE_TTL_SEC", "600"))
+ORDER_STATE_SWEEP_INTERVAL_SEC = float(os.environ.get("ORDER_STATE_SWEEP_INTERVAL_SEC", "30"))
+ORDER_STATE_SHARDS = int(os.environ.get("ORDER_STATE_SHARDS", "16"))
+# Upper bound on orders held at once, the oldest orders are evicted first
+ORDER_STATE_MAX_ENTRIES = int(os.environ.get("ORDER_STATE_MAX_ENTRIES", "10000"))
+
+# Channels to other services, shared by every handler thread of the process
+channel_registry = SyncChannelRegistry()
+
+# Resolved against the meter provider the service sets up with get_telemetry
+order_state_eviction_counter = metrics.get_meter("order-state-meter").create_counter(name="EvictedOrderStates")
 
 
 class BaseServiceWrapper:
     def __init__(self, service_id, n_services):
         self.service_id = service_id
         self.n_services = n_services
-        self.vector_clocks = dict()
-        self.order_details = dict()
-        self._main_lock = threading.Lock()
+        self.orders = ShardedOrderStore(ORDER_STATE_SHARDS, ORDER_STATE_MAX_ENTRIES)
         self.logger = None
 
+        self.order_state_ttl = ORDER_STATE_TTL_SEC
+        self._sweeper_stop = threading.Event()
+        self._sweeper = threading.Thread(target=self._run_sweeper, name="order-state-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+        else:
+            print(message)
+
+    def _new_order_record(self, order):
+        return OrderRecord(order.order_id, order, self.n_services)
+
     def InitTransaction(self, request, context):
-        with self._main_lock:
-            self.order_details[request.order_id] = request
-            self.vector_clocks[request.order_id] = [0] * self.n_services
+        evicted = self.orders.put(self._new_order_record(request))
+        if evicted:
+            self._record_evictions(evicted, "capacity")
         return order_details.StatusMessage(
             success = True,
             order_id = request.order_id
         )
 
+    def _record_evictions(self, records, reason):
+        for record in records:
+            self._log("warning", f"Evicted order id {record.order_id} ({reason}) before its ClearTransaction arrived")
+        order_state_eviction_counter.add(len(records), {"service_id": self.service_id, "reason": reason})
+
+    def _sweep_expired_orders(self):
+        expired = self.orders.pop_created_before(time.monotonic() - self.order_state_ttl)
+        if expired:
+            self._record_evictions(expired, "ttl")
+        return expired
+
+    def _run_sweeper(self):
+        while not self._sweeper_stop.wait(ORDER_STATE_SWEEP_INTERVAL_SEC):
+            try:
+                self._sweep_expired_orders()
+            except Exception as e:
+                self._log("error", f"Order state sweep failed: {str(e)}")
+
+    def _init_transaction_from_message(self, message, context):
+        """Initializes the order from the order carried by an event, returns True if it was initialized."""
+        if not message.HasField("order"):
+            return False
+        record = self._new_order_record(message.order)
+        # Concurrent events of the same order race here, only the first one stores its record
+        stored, evicted = self.orders.put_if_absent(record)
+        if evicted:
+            self._record_evictions(evicted, "capacity")
+        return stored is record
+
     def ClearTransaction(self, request, context):
-        with self._main_lock:
-            if request.order_id in self.order_details:
-                if self.logger:
-                    self.logger.info(f"Clearing transaction for order id {request.order_id} with vector clock {self.vector_clocks[request.order_id]}")
-                else:
-                    print(f"Clearing transaction for order id {request.order_id} with vector clock {self.vector_clocks[request.order_id]}")
-                del self.order_details[request.order_id]
-                del self.vector_clocks[request.order_id]
+        record = self.orders.pop(request.order_id)
+        if record is not None:
+            self._log("info", f"Clearing transaction for order id {request.order_id} with vector clock {record.vector_clock}")
         return order_details.StatusMessage(
             success = True,
             order_id = request.order_id
         )
 
+    def ClearTransactions(self, request, context):
+        statuses = [self.ClearTransaction(message, context) for message in request.messages]
+        return order_details.StatusMessageBatch(statuses=statuses)
+
+    def _get_vector_clock(self, order_id):
+        record = self.orders.get(order_id)
+        if record is None:
+            return [0] * self.n_services
+        with record.lock:
+            return list(record.vector_clock)
+
     def _update_vector_clock(self, order_id, incoming_vector_clock, increment_self=True):
-        with self._main_lock:
+        record = self.orders.get(order_id)
+        if record is None:
+            raise KeyError(f"Order id {order_id} is not found")
+        incoming_vector_clock = list(incoming_vector_clock)[:self.n_services]
+        incoming_vector_clock += [0] * (self.n_services - len(incoming_vector_clock))
+        with record.lock:
             for i in range(self.n_services):
-                self.vector_clocks[order_id][i] = max(self.vector_clocks[order_id][i], incoming_vector_clock[i])
+                record.vector_clock[i] = max(record.vector_clock[i], incoming_vector_clock[i])
             if increment_self:
-                self.vector_clocks[order_id][self.service_id] += 1
-
-    def _send_request_to_service(self, stub_class, connection_string, method_name, message):
-        for i in range(self.n_services):
-            message.vector_clock[i] = self.vector_clocks[message.order_id][i]
-        with grpc.insecure_channel(connection_string) as channel:
-            stub = stub_class(channel)
-            method = getattr(stub, method_name)
-            response = method(message)
-            self._update_vector_clock(message.order_id, response.status.vector_clock, increment_self=False)
+                record.vector_clock[self.service_id] += 1
+            return list(record.vector_clock)
+
+    def _start_request_to_service(self, stub_class, connection_string, method_name, message, context=None):
+        """Sends the event without waiting for it, finish it with _finish_request_to_service."""
+        message.vector_clock[:] = self._get_vector_clock(message.order_id)
+        # Forward what is left of the caller's deadline
+        return channel_registry.start(
+            connection_string, stub_class, method_name, message, **outgoing_call_options(context)
+        )
+
+    def _finish_request_to_service(self, message, pending_call):
+        response = pending_call.result()
+        self._update_vector_clock(message.order_id, response.status.vector_clock, increment_self=False)
         return response
+
+    def _send_request_to_service(self, stub_class, connection_string, method_name, message, context=None):
+        pending_call = self._start_request_to_service(stub_class, connection_string, method_name, message, context)
+        return self._finish_request_to_service(message, pending_call)
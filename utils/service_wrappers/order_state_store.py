@@ -0,0 +1,109 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class OrderRecord:
+    """Transient per-order state of a validation service. `lock` guards vector_clock and event_data."""
+
+    __slots__ = ("order_id", "order", "vector_clock", "event_data", "lock", "created_at")
+
+    def __init__(self, order_id, order, n_services, event_data=None):
+        self.order_id = order_id
+        self.order = order
+        self.vector_clock = [0] * n_services
+        self.event_data = event_data if event_data is not None else dict()
+        self.lock = threading.Lock()
+        self.created_at = time.monotonic()
+
+
+class _Shard:
+    __slots__ = ("lock", "records")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Insertion ordered, so the oldest order of the shard is always first
+        self.records = OrderedDict()
+
+
+class ShardedOrderStore:
+    """
+    Order records split over N shards by order id hash, each shard with its own lock.
+
+    Operations on different orders rarely contend, and shard locks are only held
+    for the dict operation itself, never while an order is being processed.
+
+    With `max_entries` set, every shard holds at most ceil(max_entries / n_shards)
+    records and `put` evicts the oldest ones of the shard to make room.
+    """
+
+    def __init__(self, n_shards=16, max_entries=None):
+        if n_shards <= 0:
+            raise ValueError("n_shards must be positive")
+        if max_entries is not None and max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.n_shards = n_shards
+        self.max_entries = max_entries
+        self._shard_capacity = math.ceil(max_entries / n_shards) if max_entries is not None else None
+        self._shards = [_Shard() for _ in range(n_shards)]
+
+    def _shard(self, order_id):
+        return self._shards[hash(order_id) % self.n_shards]
+
+    def put(self, record):
+        """Stores the record, returns the records evicted to stay within max_entries."""
+        shard = self._shard(record.order_id)
+        evicted = []
+        with shard.lock:
+            shard.records.pop(record.order_id, None)
+            shard.records[record.order_id] = record
+            if self._shard_capacity is not None:
+                while len(shard.records) > self._shard_capacity:
+                    evicted.append(shard.records.popitem(last=False)[1])
+        return evicted
+
+    def put_if_absent(self, record):
+        """
+        Stores the record unless the order already has one, in one step under the shard lock.
+        Returns (stored record, records evicted to stay within max_entries).
+        """
+        shard = self._shard(record.order_id)
+        evicted = []
+        with shard.lock:
+            existing = shard.records.get(record.order_id)
+            if existing is not None:
+                return existing, evicted
+            shard.records[record.order_id] = record
+            if self._shard_capacity is not None:
+                while len(shard.records) > self._shard_capacity:
+                    evicted.append(shard.records.popitem(last=False)[1])
+        return record, evicted
+
+    def get(self, order_id):
+        shard = self._shard(order_id)
+        with shard.lock:
+            return shard.records.get(order_id)
+
+    def pop(self, order_id):
+        shard = self._shard(order_id)
+        with shard.lock:
+            return shard.records.pop(order_id, None)
+
+    def __contains__(self, order_id):
+        return self.get(order_id) is not None
+
+    def __len__(self):
+        return sum(len(shard.records) for shard in self._shards)
+
+    def pop_created_before(self, timestamp):
+        """Removes and returns the records created before `timestamp` (time.monotonic())."""
+        expired = []
+        for shard in self._shards:
+            with shard.lock:
+                while shard.records:
+                    record = next(iter(shard.records.values()))
+                    if record.created_at >= timestamp:
+                        break
+                    expired.append(shard.records.popitem(last=False)[1])
+        return expired